@@ -1,27 +1,465 @@
 import asyncio
+import contextlib
+import hashlib
+import itertools
+import json
 import logging
+import mmap
 import os
+import re
+import shutil
+import signal
+import subprocess
 import tempfile
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Literal, Optional
 
 from mcp.server import Server
 from mcp.server.stdio import stdio_server
 from mcp.types import Tool, TextContent, ImageContent, ErrorData
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
 from pydantic_settings import BaseSettings
 
+from src.tleap_pool import TleapPool, TleapWorkerError
+
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of bytes of each output file included in tool responses
+PDB_PREVIEW_BYTES = 2000
+LOG_PREVIEW_BYTES = 64 * 1024
+
+# Inputs at least this large are staged with O_DIRECT, in chunks of the same size
+DIRECT_IO_THRESHOLD = 16 * 1024 * 1024
+DIRECT_IO_CHUNK = 16 * 1024 * 1024
+DIRECT_IO_ALIGN = 4096
+
+# Name inputs are staged under in a working directory. It may be a hardlink to the
+# caller's file, so no tool may write to it (unlike e.g. prepared.pdb)
+STAGED_INPUT_NAME = "input.pdb"
+
+# tleap outputs stored in the prepared system cache
+CACHED_SYSTEM_FILES = ("system.prmtop", "system.inpcrd", "prepared.pdb")
+
+# OpenMM's bundled AMBER force field directories (amber19 needs OpenMM >= 8.3), by
+# force field name, and the water models available in each of them
+OPENMM_FORCE_FIELDS = {"ff14SB": "amber14", "ff19SB": "amber19"}
+OPENMM_WATER_MODELS = ("tip3p", "tip3pfb", "spce", "tip4pew", "tip4pfb", "opc", "opc3")
+
+# Per-request scripts; only the fields in braces vary between calls
+TLEAP_SCRIPT_TEMPLATE = """source leaprc.protein.{force_field}
+source leaprc.water.{water_model}
+
+# Load the PDB structure
+mol = loadpdb input.pdb
+
+# Add hydrogens and prepare the system
+mol = addions mol Na+ 0
+mol = addions mol Cl- 0
+
+# Save parameter and coordinate files
+saveamberparm mol system.prmtop system.inpcrd
+
+# Save as PDB for visualization
+savepdb mol prepared.pdb
+
+quit
+"""
+
+# The leaprc lines of TLEAP_SCRIPT_TEMPLATE, for standalone batch runs
+TLEAP_SOURCE_TEMPLATE = """source leaprc.protein.{force_field}
+source leaprc.water.{water_model}
+
+"""
+
+# Body of TLEAP_SCRIPT_TEMPLATE with absolute paths, for pooled workers (which have
+# the leaprc files already sourced) and for preparing several systems in one run.
+# The unit variable is named per request: a pooled worker keeps its variables
+# between scripts, so a failed loadpdb must not leave an earlier system in `mol`
+TLEAP_SYSTEM_TEMPLATE = """# Load the PDB structure
+{mol} = loadpdb "{dir}/input.pdb"
+
+# Add hydrogens and prepare the system
+{mol} = addions {mol} Na+ 0
+{mol} = addions {mol} Cl- 0
+
+# Save parameter and coordinate files
+saveamberparm {mol} "{dir}/system.prmtop" "{dir}/system.inpcrd"
+
+# Save as PDB for visualization
+savepdb {mol} "{dir}/prepared.pdb"
+"""
+
+TLEAP_CLEAR_TEMPLATE = """clearVariables {{ {mols} }}
+"""
+
+# tleap reports problems on lines like "Error! Could not open file ..." or "FATAL: ..."
+TLEAP_ERROR_LINE = re.compile(r"^(Error!|FATAL:|Could not open)", re.MULTILINE)
+
+MIN_INPUT_TEMPLATE = """Energy minimization
+&cntrl
+  imin=1,       ! Minimize energy
+  maxcyc={steps}, ! Maximum cycles
+  ncyc={ncyc}, ! Initial steepest descent steps
+  ntpr={steps}, ! Only print the final energies
+  ntb=0,        ! No periodic boundaries
+  cut=999.0,    ! No cutoff
+&end
+"""
+
+RESTRAINED_MIN_INPUT_TEMPLATE = """Energy minimization
+&cntrl
+  imin=1,       ! Minimize energy
+  maxcyc={steps}, ! Maximum cycles
+  ncyc={ncyc}, ! Initial steepest descent steps
+  ntpr={steps}, ! Only print the final energies
+  ntb=0,        ! No periodic boundaries
+  cut=999.0,    ! No cutoff
+  ntr=1,        ! Apply restraints
+  restraint_wt=10.0, ! Restraint weight
+  restraintmask='@CA,C,N', ! Restrain backbone atoms
+&end
+"""
+
+RESTRAINT_FILE = """Hold backbone atoms fixed
+10.0
+RES 1 999
+END
+END
+"""
+
+# Skip the close-fds loop (our fds are non-inheritable anyway) and run each tool in
+# its own session so a timed-out run can be killed with all of its children
+SUBPROCESS_OPTIONS = {"close_fds": False, "start_new_session": True}
+
+
+def _resolve_executable(name: str) -> str:
+    """Resolve an executable to an absolute path once so spawns skip the PATH search"""
+    return shutil.which(name) or name
+
+
+def _kill_process_group(process: asyncio.subprocess.Process) -> None:
+    """Kill a process started with SUBPROCESS_OPTIONS along with its process group"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        process.kill()
+
+
+def _detect_gpus() -> list[str]:
+    """Return the indices of the host's NVIDIA GPUs, via NVML or else nvidia-smi"""
+    try:
+        import pynvml
+    except ImportError:
+        pass
+    else:
+        try:
+            pynvml.nvmlInit()
+            try:
+                return [str(i) for i in range(pynvml.nvmlDeviceGetCount())]
+            finally:
+                pynvml.nvmlShutdown()
+        except pynvml.NVMLError:
+            return []
+
+    if not shutil.which("nvidia-smi"):
+        return []
+    try:
+        result = subprocess.run(
+            ["nvidia-smi", "-L"], capture_output=True, text=True, timeout=10
+        )
+    except (subprocess.TimeoutExpired, OSError):
+        return []
+    gpus = [line for line in result.stdout.splitlines() if line.startswith("GPU ")]
+    return [str(i) for i in range(len(gpus))]
+
+
+def _default_temp_dir() -> Optional[str]:
+    """Use RAM-backed /dev/shm for working files when available, else the default"""
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK | os.X_OK):
+        return shm
+    return None
+
+
+# Coordinate records tleap can build a system from
+PDB_ATOM_RECORD = re.compile(rb"^(ATOM  |HETATM)", re.MULTILINE)
+# Record names (columns 1-6) are ASCII; free text such as REMARKs may be UTF-8
+PDB_NON_ASCII_RECORD = re.compile(rb"^[^\n\x80-\xff]{0,5}[\x80-\xff]", re.MULTILINE)
+PDB_CHECK_BYTES = 64 * 1024
+
+
+def _quick_pdb_check(path: Path) -> Optional[str]:
+    """Cheaply reject files that are clearly not PDBs; returns an error or None"""
+    carry = b""
+    with open(path, "rb") as f:
+        # Scan in chunks so long headers do not hide the first coordinate record
+        while chunk := f.read(PDB_CHECK_BYTES):
+            window = carry + chunk
+            if PDB_NON_ASCII_RECORD.search(window):
+                return "Input does not look like a PDB file: non-ASCII record name"
+            if PDB_ATOM_RECORD.search(window):
+                return None
+            # Keep the record name of a line split across chunks
+            carry = window[window.rfind(b"\n") + 1:][:6]
+    return "Input does not look like a PDB file: no ATOM or HETATM records"
+
+
+def _openmm_force_field_files(
+    force_field: str, water_model: str
+) -> Optional[tuple[str, str]]:
+    """OpenMM XML files for a force field and water model, or None if not bundled"""
+    family = OPENMM_FORCE_FIELDS.get(force_field)
+    if family is None or water_model not in OPENMM_WATER_MODELS:
+        return None
+    return f"{family}/protein.{force_field}.xml", f"{family}/{water_model}.xml"
+
+
+async def _gather_or_cancel(*aws):
+    """Like asyncio.gather, but cancels and awaits the other tasks when one fails"""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def _head_and_size(path: Path, n: int) -> tuple[str, int]:
+    """Read at most the first n bytes of a file, returning the text and full size"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        head = f.read(n)
+    return head.decode(errors="replace"), size
+
+
+def _open_tool_output(tmpdir: Path, name: str):
+    """Open <name>.stdout and <name>.stderr in tmpdir for a tool to write to"""
+    stdout_f = open(tmpdir / f"{name}.stdout", "wb")
+    try:
+        return stdout_f, open(tmpdir / f"{name}.stderr", "wb")
+    except BaseException:
+        stdout_f.close()
+        raise
+
+
+def _sourced_output(log: str, script: Path) -> str:
+    """The part of a tleap log printed while sourcing script, from its
+    "----- Source:" line to its "----- Source of ... done" line"""
+    start = log.find(f"----- Source: {script}")
+    if start == -1:
+        return ""
+    end = log.find(f"----- Source of {script} done", start)
+    if end == -1:
+        return log[start:]
+    end = log.find("\n", end)
+    return log[start:] if end == -1 else log[start:end + 1]
+
+
+def _has_system_outputs(workdir: Path) -> bool:
+    return (workdir / "system.prmtop").exists() and (workdir / "system.inpcrd").exists()
+
+
+def _read_tail(path: Path, n: int = LOG_PREVIEW_BYTES) -> str:
+    """Read at most the last n bytes of a file"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        f.seek(max(0, size - n))
+        return f.read().decode(errors="replace")
+
+
+def _stage_input(src: Path, dst: Path) -> None:
+    """Place an input file in the working directory without Python-level copying"""
+    try:
+        # Hardlink when on the same filesystem; dst must be a name no tool writes to
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+
+    if hasattr(os, "O_DIRECT") and os.stat(src).st_size >= DIRECT_IO_THRESHOLD:
+        try:
+            _copy_direct(src, dst)
+            return
+        except OSError as e:
+            logger.debug(f"O_DIRECT copy of {src} failed, using buffered copy: {e}")
+
+    # Kernel-side copy (copy_file_range/sendfile) across filesystems
+    shutil.copyfile(src, dst)
+
+
+def _input_hash(pdb_file: Path) -> str:
+    """Hash the contents of an input PDB"""
+    h = hashlib.blake2b(digest_size=20)
+    with open(pdb_file, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _system_cache_key(input_hash: str, force_field: str, water_model: str) -> str:
+    """Combine an _input_hash and the preparation parameters into a cache key"""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(b"\0".join(s.encode() for s in (input_hash, force_field, water_model)))
+    # Invalidate cached systems whenever the preparation script changes
+    h.update(b"\0" + TLEAP_SCRIPT_TEMPLATE.encode())
+    return h.hexdigest()
+
+
+def _read_system_metadata(entry: Path) -> Optional[dict]:
+    """Read the force field, water model and input hash stored with a prepared system"""
+    try:
+        return json.loads((entry / "system.json").read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _evict_lru(cache_dir: Path, max_bytes: int) -> None:
+    """Remove least recently used cache entries until the cache fits in max_bytes"""
+    entries = []
+    total = 0
+    for entry in cache_dir.iterdir():
+        if not entry.is_dir() or entry.name.startswith("."):
+            continue
+        size = sum(f.stat().st_size for f in entry.iterdir())
+        entries.append((entry.stat().st_mtime, size, entry))
+        total += size
+
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def _copy_direct(src: Path, dst: Path) -> None:
+    """Copy a large file with O_DIRECT through a page-aligned buffer"""
+    src_fd = os.open(src, os.O_RDONLY | os.O_DIRECT)
+    try:
+        size = os.fstat(src_fd).st_size
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        try:
+            dst_fd = os.open(dst, flags | os.O_DIRECT, 0o644)
+            direct_write = True
+        except OSError:
+            # Some filesystems (e.g. tmpfs) do not support O_DIRECT
+            dst_fd = os.open(dst, flags, 0o644)
+            direct_write = False
+
+        try:
+            # Anonymous mappings are page-aligned, as O_DIRECT requires
+            with mmap.mmap(-1, DIRECT_IO_CHUNK) as buf:
+                view = memoryview(buf)
+                try:
+                    while True:
+                        n = os.readv(src_fd, [view])
+                        if n == 0:
+                            break
+                        if direct_write and n % DIRECT_IO_ALIGN:
+                            # Pad the final partial block; the file is trimmed below
+                            n += DIRECT_IO_ALIGN - n % DIRECT_IO_ALIGN
+                        os.write(dst_fd, view[:n])
+                finally:
+                    view.release()
+            if direct_write:
+                os.ftruncate(dst_fd, size)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+
+# Force field and water model names are spliced into tleap scripts as leaprc suffixes
+LEAP_NAME_PATTERN = r"^[A-Za-z0-9_.]+$"
+
+# Most structures accepted by one amber_relax_pdb_batch request
+MAX_BATCH_FILES = 100
+
+
+class RelaxArgs(BaseModel):
+    input_file: str
+    force_field: str = Field(default="ff19SB", pattern=LEAP_NAME_PATTERN)
+    steps: int = Field(default=10000, gt=0)
+    restraints: bool = False
+    include_structure: bool = True
+    prepared_system_id: Optional[str] = Field(default=None, pattern=r"^[0-9a-f]{40}$")
+
+
+class RelaxBatchArgs(BaseModel):
+    input_files: list[str] = Field(min_length=1, max_length=MAX_BATCH_FILES)
+    force_field: str = Field(default="ff19SB", pattern=LEAP_NAME_PATTERN)
+    steps: int = Field(default=10000, gt=0)
+    restraints: bool = False
+    include_structure: bool = True
+
+
+class PrepareArgs(BaseModel):
+    input_file: str
+    force_field: str = Field(default="ff19SB", pattern=LEAP_NAME_PATTERN)
+    water_model: str = Field(default="tip3p", pattern=LEAP_NAME_PATTERN)
+
 
 class ServerSettings(BaseSettings):
     max_file_size: int = Field(default=100_000_000, description="Maximum input file size in bytes")
-    temp_dir: Optional[str] = Field(default=None, description="Temporary directory for processing")
+    temp_dir: Optional[str] = Field(
+        default_factory=_default_temp_dir,
+        description=(
+            "Temporary directory for processing (defaults to /dev/shm when writable)"
+        ),
+    )
     timeout: int = Field(default=1800, description="Command timeout in seconds (30 minutes for MD)")
     amber_path: str = Field(default="amber", description="Path to amber installation")
     tleap_path: str = Field(default="tleap", description="Path to tleap executable")
-    pmemd_path: str = Field(default="pmemd", description="Path to pmemd executable")
+    tleap_workers: int = Field(
+        default=0,
+        description=(
+            "Persistent tleap workers per force field (0 starts tleap per request)"
+        ),
+    )
+    pmemd_path: str = Field(
+        default="pmemd", description="Path to pmemd executable (CPU fallback)"
+    )
+    ambpdb_path: str = Field(default="ambpdb", description="Path to ambpdb executable")
+    pmemd_cuda_path: str = Field(
+        default="pmemd.cuda",
+        description="Path to GPU-accelerated pmemd.cuda executable",
+    )
+    use_gpu: bool = Field(
+        default=True, description="Use pmemd.cuda for minimization when available"
+    )
+    precision: Literal["SPFP", "DPFP", "SPXP"] = Field(
+        default="SPFP",
+        description=(
+            "pmemd.cuda precision model; selects the pmemd.cuda_<precision> build "
+            "when installed"
+        ),
+    )
+    cuda_visible_devices: Optional[str] = Field(
+        default=None, description="CUDA_VISIBLE_DEVICES value passed to pmemd.cuda"
+    )
+    cache_dir: Optional[str] = Field(
+        default=None,
+        description="Directory for caching prepared systems (disabled if unset)",
+    )
+    cache_max_bytes: int = Field(
+        default=1_000_000_000,
+        description="Maximum total size of the prepared system cache in bytes",
+    )
+    session_max_bytes: int = Field(
+        default=100_000_000,
+        description=(
+            "Maximum total size of systems kept for prepared_system_id when the "
+            "cache is disabled"
+        ),
+    )
+    backend: Literal["amber", "openmm"] = Field(
+        default="amber",
+        description=(
+            "Relaxation backend: AMBER tools (tleap/pmemd) or in-process OpenMM"
+        ),
+    )
     
     model_config = ConfigDict(env_prefix="BIO_MCP_")
 
@@ -30,7 +468,97 @@ class AmberServer:
     def __init__(self, settings: Optional[ServerSettings] = None):
         self.settings = settings or ServerSettings()
         self.server = Server("bio-mcp-amber")
+        self._tleap = _resolve_executable(self.settings.tleap_path)
+        pmemd, self._pmemd_is_cuda = self._select_pmemd()
+        self._pmemd = _resolve_executable(pmemd)
+        self._gpu_devices = self._select_gpus() if self._pmemd_is_cuda else []
+        self._free_gpus: Optional[asyncio.Queue] = None
+        self._ambpdb = _resolve_executable(self.settings.ambpdb_path)
+        self._session_dir: Optional[Path] = None
+        self._leap_ids = itertools.count(1)  # unit variable names for tleap scripts
+        self._tleap_pool = None
+        if self.settings.tleap_workers > 0:
+            self._tleap_pool = TleapPool(
+                self._tleap,
+                self.settings.tleap_workers,
+                self.settings.timeout,
+                spawn_options=SUBPROCESS_OPTIONS,
+            )
         self._setup_handlers()
+
+    def _select_pmemd(self) -> tuple[str, bool]:
+        """Pick pmemd.cuda when GPU use is enabled and it is installed, else CPU pmemd.
+
+        Returns the executable and whether it is a pmemd.cuda build.
+        """
+        if self.settings.use_gpu:
+            # Precision is fixed when pmemd.cuda is built; prefer the matching build
+            cuda_path = self.settings.pmemd_cuda_path
+            precision_path = f"{cuda_path}_{self.settings.precision}"
+            if shutil.which(precision_path):
+                logger.info(f"Using GPU minimization engine: {precision_path}")
+                return precision_path, True
+            if shutil.which(cuda_path):
+                if self.settings.precision != "SPFP":
+                    logger.warning(
+                        f"{precision_path} not found, using {cuda_path} "
+                        "(usually the SPFP build)"
+                    )
+                logger.info(f"Using GPU minimization engine: {cuda_path}")
+                return cuda_path, True
+            logger.info(
+                f"{cuda_path} not found, falling back to {self.settings.pmemd_path}"
+            )
+        else:
+            logger.info(
+                "GPU disabled, using CPU minimization engine: "
+                f"{self.settings.pmemd_path}"
+            )
+        return self.settings.pmemd_path, False
+
+    def _select_gpus(self) -> list[str]:
+        """GPUs to spread pmemd.cuda runs over: the configured devices, else the
+        ones the server was started with in CUDA_VISIBLE_DEVICES, else all detected"""
+        visible = self.settings.cuda_visible_devices
+        if visible is None:
+            # Per-run pinning replaces CUDA_VISIBLE_DEVICES; stay within inherited ones
+            visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+        if visible is not None:
+            devices = [d.strip() for d in visible.split(",") if d.strip()]
+        else:
+            devices = _detect_gpus()
+        if devices:
+            logger.info(f"Scheduling pmemd.cuda runs on GPUs: {', '.join(devices)}")
+        return devices
+
+    @contextlib.asynccontextmanager
+    async def _acquire_gpu(self):
+        """Reserve a free GPU for one run, yielding its index (None if not pinning)"""
+
+
+        if not self._gpu_devices:
+            yield None
+            return
+
+        # pmemd.cuda does not scale across GPUs, so each run gets a device of its own
+        if self._free_gpus is None:
+            self._free_gpus = asyncio.Queue()
+            for device in self._gpu_devices:
+                self._free_gpus.put_nowait(device)
+        device = await self._free_gpus.get()
+        try:
+            yield device
+        finally:
+            self._free_gpus.put_nowait(device)
+
+    def _subprocess_env(self, gpu: Optional[str] = None) -> dict:
+        """Environment for child processes, pinning GPUs if configured"""
+        env = dict(os.environ)
+        if gpu is not None:
+            env["CUDA_VISIBLE_DEVICES"] = gpu
+        elif self.settings.cuda_visible_devices is not None:
+            env["CUDA_VISIBLE_DEVICES"] = self.settings.cuda_visible_devices
+        return env
         
     def _setup_handlers(self):
         @self.server.list_tools()
@@ -54,17 +582,83 @@ class AmberServer:
                             "steps": {
                                 "type": "integer",
                                 "description": "Number of minimization steps (default: 10000)",
-                                "default": 10000
+                                "default": 10000,
+                                "minimum": 1
                             },
                             "restraints": {
                                 "type": "boolean",
                                 "description": "Apply positional restraints to backbone atoms (default: false)",
                                 "default": False
+                            },
+                            "include_structure": {
+                                "type": "boolean",
+                                "description": (
+                                    "Include the relaxed coordinates in the response "
+                                    "(default: true)"
+                                ),
+                                "default": True
+                            },
+                            "prepared_system_id": {
+                                "type": "string",
+                                "description": (
+                                    "ID returned by amber_prepare_system; reuses that "
+                                    "system instead of running tleap again"
+                                )
                             }
                         },
                         "required": ["input_file"]
                     }
                 ),
+                Tool(
+                    name="amber_relax_pdb_batch",
+                    description=(
+                        "Relax several PDB structures in one request, sharing a "
+                        "single tleap run"
+
+                    ),
+                    inputSchema={
+                        "type": "object",
+                        "properties": {
+                            "input_files": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "minItems": 1,
+                                "maxItems": MAX_BATCH_FILES,
+                                "description": "Paths to input PDB files"
+                            },
+                            "force_field": {
+                                "type": "string",
+                                "description": "Force field to use (default: ff19SB)",
+                                "default": "ff19SB"
+                            },
+                            "steps": {
+                                "type": "integer",
+                                "description": (
+                                    "Number of minimization steps (default: 10000)"
+                                ),
+                                "default": 10000,
+                                "minimum": 1
+                            },
+                            "restraints": {
+                                "type": "boolean",
+                                "description": (
+                                    "Apply positional restraints to backbone atoms "
+                                    "(default: false)"
+                                ),
+                                "default": False
+                            },
+                            "include_structure": {
+                                "type": "boolean",
+                                "description": (
+                                    "Include the relaxed coordinates in the response "
+                                    "(default: true)"
+                                ),
+                                "default": True
+                            }
+                        },
+                        "required": ["input_files"]
+                    }
+                ),
                 Tool(
                     name="amber_prepare_system",
                     description="Prepare a PDB structure for AMBER simulation by adding hydrogens and parameters",
@@ -95,111 +689,394 @@ class AmberServer:
         async def call_tool(name: str, arguments: Any) -> list[TextContent | ImageContent | ErrorData]:
             if name == "amber_relax_pdb":
                 return await self._relax_pdb(arguments)
+            elif name == "amber_relax_pdb_batch":
+                return await self._relax_pdb_batch(arguments)
             elif name == "amber_prepare_system":
                 return await self._prepare_system(arguments)
             else:
                 return [ErrorData(code=500, message=f"Unknown tool: {name}")]
     
     async def _relax_pdb(self, arguments: dict) -> list[TextContent | ErrorData]:
+        try:
+            args = RelaxArgs.model_validate(arguments)
+        except ValidationError as e:
+            return [ErrorData(code=400, message=f"Invalid arguments: {e}")]
+
         try:
             # Validate input file
-            input_path = Path(arguments["input_file"])
-            if not input_path.exists():
+            input_path = Path(args.input_file)
+            try:
+                input_stat = await asyncio.to_thread(os.stat, input_path)
+            except FileNotFoundError:
                 return [ErrorData(code=404, message=f"Input file not found: {input_path}")]
             
-            if input_path.stat().st_size > self.settings.max_file_size:
+            if input_stat.st_size > self.settings.max_file_size:
                 return [ErrorData(code=413, message=f"File too large. Maximum size: {self.settings.max_file_size} bytes")]
             
-            force_field = arguments.get("force_field", "ff19SB")
-            steps = arguments.get("steps", 10000)
-            restraints = arguments.get("restraints", False)
+            # Reject malformed input before paying for a tleap start-up
+            if error := await asyncio.to_thread(_quick_pdb_check, input_path):
+                return [ErrorData(code=400, message=error)]
+
+            if (
+                self.settings.backend == "openmm"
+                and _openmm_force_field_files(args.force_field, "tip3p") is None
+            ):
+                return [ErrorData(code=400, message=(
+                    self._unsupported_openmm_force_field(args.force_field)
+                ))]
+
+            if args.prepared_system_id is not None:
+                if self.settings.backend != "amber":
+                    return [ErrorData(code=400, message=(
+                        "prepared_system_id is only supported with the amber backend"
+                    ))]
+                prepared_entry = self._find_prepared_system(args.prepared_system_id)
+                metadata = None
+                if prepared_entry is not None:
+                    metadata = await asyncio.to_thread(
+                        _read_system_metadata, prepared_entry
+                    )
+                if metadata is None:
+                    return [ErrorData(code=404, message=(
+                        f"Prepared system not found: {args.prepared_system_id}"
+                    ))]
+
+                # The ID only names a system; make sure it matches this request
+                if metadata["input_hash"] != await asyncio.to_thread(
+                    _input_hash, input_path
+                ):
+                    return [ErrorData(code=400, message=(
+                        f"Prepared system {args.prepared_system_id} was not prepared "
+                        f"from {input_path}"
+                    ))]
+                if metadata["force_field"] != args.force_field:
+                    return [ErrorData(code=400, message=(
+                        f"Prepared system {args.prepared_system_id} uses force field "
+                        f"{metadata['force_field']}, not {args.force_field}"
+                    ))]
+
+
+            force_field = args.force_field
+            steps = args.steps
+            restraints = args.restraints
             
             # Create temporary directory for processing
             with tempfile.TemporaryDirectory(dir=self.settings.temp_dir) as tmpdir:
                 tmpdir_path = Path(tmpdir)
                 
-                # Copy input file to temp directory
-                temp_input = tmpdir_path / input_path.name
-                temp_input.write_bytes(input_path.read_bytes())
-                
-                # Step 1: Prepare the system with tleap
-                prep_result = await self._prepare_system_internal(tmpdir_path, temp_input, force_field, "tip3p")
-                if not prep_result["success"]:
-                    return [ErrorData(code=500, message=f"System preparation failed: {prep_result['error']}")]
-                
-                # Step 2: Run energy minimization
-                min_result = await self._run_minimization(tmpdir_path, steps, restraints)
-                if not min_result["success"]:
-                    return [ErrorData(code=500, message=f"Minimization failed: {min_result['error']}")]
+                # Stage the input under a name no tool writes to
+                temp_input = tmpdir_path / STAGED_INPUT_NAME
+                await asyncio.to_thread(_stage_input, input_path, temp_input)
                 
-                # Read output files
-                output_pdb = tmpdir_path / "minimized.pdb"
-                output_log = tmpdir_path / "minimization.log"
+                if self.settings.backend == "openmm":
+                    # Parameterize and minimize in-process with OpenMM
+                    min_result = await self._relax_pdb_openmm(
+                        tmpdir_path, temp_input, force_field, "tip3p", steps, restraints
+                    )
+                    if not min_result["success"]:
+                        return [ErrorData(code=500, message=(
+                            f"Minimization failed: {min_result['error']}"
+                        ))]
+                else:
+                    # Step 1: Prepare the system with tleap while writing pmemd inputs
+                    if args.prepared_system_id is not None:
+                        prep_coro = self._load_prepared_system(
+                            prepared_entry, tmpdir_path
+                        )
+                    else:
+                        prep_coro = self._prepare_system_cached(
+                            tmpdir_path, temp_input, force_field, "tip3p"
+                        )
+                    prep_result, _ = await _gather_or_cancel(
+                        prep_coro,
+                        self._write_min_inputs(tmpdir_path, steps, restraints),
+                    )
+                    if not prep_result["success"]:
+                        return [ErrorData(code=500, message=(
+                            f"System preparation failed: {prep_result['error']}"
+                        ))]
+
+                    # Step 2: Run energy minimization
+                    min_result = await self._run_minimization(
+                        tmpdir_path, steps, restraints, inputs_written=True
+                    )
+                    if not min_result["success"]:
+                        return [ErrorData(code=500, message=(
+                            f"Minimization failed: {min_result['error']}"
+                        ))]
                 
-                result_text = f"AMBER PDB relaxation completed successfully!\n\n"
-                result_text += f"Force field: {force_field}\n"
-                result_text += f"Minimization steps: {steps}\n"
-                result_text += f"Restraints applied: {restraints}\n\n"
+                result_text = await self._relaxation_report(
+                    tmpdir_path, force_field, steps, restraints, args.include_structure
+                )
+                return [TextContent(type="text", text=result_text)]
                 
-                if output_log.exists():
-                    result_text += "Minimization log:\n"
-                    result_text += output_log.read_text()
-                    result_text += "\n\n"
+        except Exception as e:
+            logger.error(f"Error running AMBER relaxation: {e}", exc_info=True)
+            return [ErrorData(code=500, message=f"Error: {str(e)}")]
+
+    async def _relax_pdb_batch(self, arguments: dict) -> list[TextContent | ErrorData]:
+        try:
+            args = RelaxBatchArgs.model_validate(arguments)
+        except ValidationError as e:
+            return [ErrorData(code=400, message=f"Invalid arguments: {e}")]
+
+        try:
+            # Validate all input files before doing any work
+            input_paths = [Path(input_file) for input_file in args.input_files]
+            for input_path in input_paths:
+                try:
+                    input_stat = await asyncio.to_thread(os.stat, input_path)
+                except FileNotFoundError:
+                    return [ErrorData(code=404, message=(
+                        f"Input file not found: {input_path}"
+                    ))]
                 
-                if output_pdb.exists():
-                    result_text += f"Relaxed structure saved to: {output_pdb}\n"
-                    result_text += f"Final structure coordinates:\n"
-                    result_text += output_pdb.read_text()[:2000]  # First 2000 chars
-                    if len(output_pdb.read_text()) > 2000:
-                        result_text += "\n... (truncated)"
+                if input_stat.st_size > self.settings.max_file_size:
+                    return [ErrorData(code=413, message=(
+                        f"File too large: {input_path}. "
+                        f"Maximum size: {self.settings.max_file_size} bytes"
+                    ))]
+
+                if error := await asyncio.to_thread(_quick_pdb_check, input_path):
+                    return [ErrorData(code=400, message=f"{input_path}: {error}")]
+
+            if (
+                self.settings.backend == "openmm"
+                and _openmm_force_field_files(args.force_field, "tip3p") is None
+            ):
+                return [ErrorData(code=400, message=(
+                    self._unsupported_openmm_force_field(args.force_field)
+                ))]
+
+            force_field = args.force_field
+            steps = args.steps
+            restraints = args.restraints
+
+            # Create temporary directory for processing
+            with tempfile.TemporaryDirectory(dir=self.settings.temp_dir) as tmpdir:
+                tmpdir_path = Path(tmpdir)
+
+                # Give each structure its own working directory
+                temp_inputs = []
+                for i, input_path in enumerate(input_paths):
+                    workdir = tmpdir_path / str(i)
+                    workdir.mkdir()
+                    temp_input = workdir / STAGED_INPUT_NAME
+                    await asyncio.to_thread(_stage_input, input_path, temp_input)
+                    temp_inputs.append(temp_input)
+
+                if self.settings.backend == "openmm":
+                    min_results = []
+                    for temp_input in temp_inputs:
+                        min_results.append(await self._relax_pdb_openmm(
+                            temp_input.parent, temp_input, force_field, "tip3p",
+                            steps, restraints
+                        ))
+                else:
+                    # Step 1: Prepare all systems in one tleap run, writing pmemd inputs
+                    # meanwhile
+
+                    prep_results, *_ = await _gather_or_cancel(
+                        self._prepare_systems_batch(
+                            tmpdir_path, temp_inputs, force_field, "tip3p"
+                        ),
+                        *(
+                            self._write_min_inputs(temp_input.parent, steps, restraints)
+                            for temp_input in temp_inputs
+                        ),
+                    )
+
+                    # Step 2: Minimize each prepared system
+                    min_results = []
+                    for temp_input, prep_result in zip(temp_inputs, prep_results):
+                        if not prep_result["success"]:
+                            error = f"System preparation failed: {prep_result['error']}"
+                            min_results.append({"success": False, "error": error})
+                            continue
+                        min_result = await self._run_minimization(
+                            temp_input.parent, steps, restraints, inputs_written=True
+                        )
+                        if not min_result["success"]:
+                            min_result["error"] = (
+                                f"Minimization failed: {min_result['error']}"
+                            )
+                        min_results.append(min_result)
                 
-                return [TextContent(type="text", text=result_text)]
+                results = []
+                for input_path, temp_input, min_result in zip(
+                    input_paths, temp_inputs, min_results
+                ):
+                    if not min_result["success"]:
+                        results.append(ErrorData(code=500, message=(
+                            f"{input_path}: {min_result['error']}"
+                        )))
+                        continue
+                    result_text = await self._relaxation_report(
+                        temp_input.parent,
+                        force_field,
+                        steps,
+                        restraints,
+                        args.include_structure,
+                    )
+                    results.append(
+                        TextContent(
+                            type="text", text=f"Input file: {input_path}\n{result_text}"
+                        )
+                    )
+                return results
                 
         except Exception as e:
-            logger.error(f"Error running AMBER relaxation: {e}", exc_info=True)
+            logger.error(f"Error running AMBER batch relaxation: {e}", exc_info=True)
             return [ErrorData(code=500, message=f"Error: {str(e)}")]
     
+    @staticmethod
+    def _unsupported_openmm_force_field(force_field: str) -> str:
+        return (f"Force field {force_field} is not supported by the OpenMM backend "
+                f"(supported: {', '.join(OPENMM_FORCE_FIELDS)})")
+
+    async def _relaxation_report(
+        self,
+        tmpdir: Path,
+        force_field: str,
+        steps: int,
+        restraints: bool,
+        include_structure: bool = True,
+    ) -> str:
+        """Summarize a completed relaxation from the output files in tmpdir"""
+        output_pdb = tmpdir / "minimized.pdb"
+        output_log = tmpdir / "minimization.log"
+
+        parts = [
+            "AMBER PDB relaxation completed successfully!\n\n",
+            f"Force field: {force_field}\n",
+            f"Minimization steps: {steps}\n",
+            f"Restraints applied: {restraints}\n\n",
+        ]
+
+        try:
+            log_text, log_size = await asyncio.to_thread(
+                _head_and_size, output_log, LOG_PREVIEW_BYTES
+            )
+        except FileNotFoundError:
+            pass
+        else:
+            parts += ["Minimization log:\n", log_text]
+            if log_size > LOG_PREVIEW_BYTES:
+                parts.append(
+                    f"\n... (log truncated to first {LOG_PREVIEW_BYTES} of "
+                    f"{log_size} bytes)"
+                )
+
+            parts.append("\n\n")
+
+        if include_structure:
+            try:
+                pdb_text, pdb_size = await asyncio.to_thread(
+                    _head_and_size, output_pdb, PDB_PREVIEW_BYTES
+                )
+            except FileNotFoundError:
+                pass
+            else:
+                parts += [
+                    f"Relaxed structure saved to: {output_pdb}\n",
+                    "Final structure coordinates:\n",
+                    pdb_text,
+                ]
+                if pdb_size > PDB_PREVIEW_BYTES:
+                    parts.append("\n... (truncated)")
+        else:
+            try:
+                pdb_size = (await asyncio.to_thread(os.stat, output_pdb)).st_size
+            except FileNotFoundError:
+                pass
+            else:
+                parts.append(
+                    f"Relaxed structure: {pdb_size} bytes (coordinates omitted)\n"
+                )
+
+        return "".join(parts)
+
     async def _prepare_system(self, arguments: dict) -> list[TextContent | ErrorData]:
+        try:
+            args = PrepareArgs.model_validate(arguments)
+        except ValidationError as e:
+            return [ErrorData(code=400, message=f"Invalid arguments: {e}")]
+
         try:
             # Validate input file
-            input_path = Path(arguments["input_file"])
-            if not input_path.exists():
+            input_path = Path(args.input_file)
+            try:
+                input_stat = await asyncio.to_thread(os.stat, input_path)
+            except FileNotFoundError:
                 return [ErrorData(code=404, message=f"Input file not found: {input_path}")]
             
-            if input_path.stat().st_size > self.settings.max_file_size:
+            if input_stat.st_size > self.settings.max_file_size:
                 return [ErrorData(code=413, message=f"File too large. Maximum size: {self.settings.max_file_size} bytes")]
             
-            force_field = arguments.get("force_field", "ff19SB")
-            water_model = arguments.get("water_model", "tip3p")
+            # Reject malformed input before paying for a tleap start-up
+            if error := await asyncio.to_thread(_quick_pdb_check, input_path):
+                return [ErrorData(code=400, message=error)]
+
+            force_field = args.force_field
+            water_model = args.water_model
             
             # Create temporary directory for processing
             with tempfile.TemporaryDirectory(dir=self.settings.temp_dir) as tmpdir:
                 tmpdir_path = Path(tmpdir)
                 
-                # Copy input file to temp directory
-                temp_input = tmpdir_path / input_path.name
-                temp_input.write_bytes(input_path.read_bytes())
+                # Stage the input under a name no tool writes to
+                temp_input = tmpdir_path / STAGED_INPUT_NAME
+                await asyncio.to_thread(_stage_input, input_path, temp_input)
                 
                 # Prepare the system
-                result = await self._prepare_system_internal(tmpdir_path, temp_input, force_field, water_model)
+                input_hash = await asyncio.to_thread(_input_hash, temp_input)
+                result = await self._prepare_system_cached(
+                    tmpdir_path,
+                    temp_input,
+                    force_field,
+                    water_model,
+                    input_hash=input_hash,
+                )
                 
                 if not result["success"]:
                     return [ErrorData(code=500, message=f"System preparation failed: {result['error']}")]
                 
+                # Keep the prepared system so amber_relax_pdb can reuse it
+                system_id = result.get("system_id")
+                if system_id is None:
+                    system_id = _system_cache_key(input_hash, force_field, water_model)
+                    try:
+                        await asyncio.to_thread(
+                            self._store_cached_system, self._get_session_dir(),
+                            system_id, tmpdir_path, result["log"], input_hash,
+                            force_field, water_model
+                        )
+                    except OSError as e:
+                        logger.warning(f"Failed to keep prepared system: {e}")
+                        system_id = None
+
                 # Read output files
                 output_text = f"AMBER system preparation completed successfully!\n\n"
                 output_text += f"Force field: {force_field}\n"
                 output_text += f"Water model: {water_model}\n\n"
+                if system_id is not None:
+                    output_text += (
+                        f"Prepared system ID: {system_id} "
+                        "(pass as prepared_system_id to amber_relax_pdb)\n\n"
+                    )
                 output_text += f"tleap log:\n{result['log']}\n\n"
                 
                 # Check for generated files
-                prmtop_file = tmpdir_path / "system.prmtop"
-                inpcrd_file = tmpdir_path / "system.inpcrd"
-                
-                if prmtop_file.exists():
-                    output_text += f"Parameter file generated: system.prmtop ({prmtop_file.stat().st_size} bytes)\n"
-                if inpcrd_file.exists():
-                    output_text += f"Coordinate file generated: system.inpcrd ({inpcrd_file.stat().st_size} bytes)\n"
+                for label, name in (
+                    ("Parameter", "system.prmtop"),
+                    ("Coordinate", "system.inpcrd"),
+                ):
+                    try:
+                        stat = await asyncio.to_thread(os.stat, tmpdir_path / name)
+                        size = stat.st_size
+                    except FileNotFoundError:
+                        continue
+                    output_text += f"{label} file generated: {name} ({size} bytes)\n"
                 
                 return [TextContent(type="text", text=output_text)]
                 
@@ -207,93 +1084,365 @@ class AmberServer:
             logger.error(f"Error preparing AMBER system: {e}", exc_info=True)
             return [ErrorData(code=500, message=f"Error: {str(e)}")]
     
-    async def _prepare_system_internal(self, tmpdir: Path, pdb_file: Path, force_field: str, water_model: str) -> dict:
-        """Internal method to prepare AMBER system using tleap"""
+    async def _run_tool(
+        self, cmd: list[str], tmpdir: Path, name: str, env: Optional[dict] = None
+    ) -> Optional[int]:
+        """Run a tool in tmpdir, streaming its output to <name>.stdout and .stderr.
+
+
+        Returns the exit code, or None if the tool timed out.
+        """
+        stdout_f, stderr_f = await asyncio.to_thread(_open_tool_output, tmpdir, name)
+        with stdout_f, stderr_f:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=stdout_f,
+                stderr=stderr_f,
+                cwd=tmpdir,
+                env=env,
+                **SUBPROCESS_OPTIONS
+            )
+
         try:
-            # Create tleap script
-            tleap_script = tmpdir / "prep.leap"
-            script_content = f"""source leaprc.protein.{force_field}
-source leaprc.water.{water_model}
+            await asyncio.wait_for(process.wait(), timeout=self.settings.timeout)
+        except asyncio.TimeoutError:
+            # Reap the killed process so it does not linger as a zombie
+            _kill_process_group(process)
+            await process.wait()
+            return None
+        except asyncio.CancelledError:
+            # The request was abandoned; do not leave the tool running
+            _kill_process_group(process)
+            await process.wait()
+            raise
+        return process.returncode
 
-# Load the PDB structure
-mol = loadpdb {pdb_file.name}
+    async def _prepare_system_cached(
+        self,
+        tmpdir: Path,
+        pdb_file: Path,
+        force_field: str,
+        water_model: str,
+        input_hash: Optional[str] = None,
+    ) -> dict:
+        """Prepare the system, reusing cached tleap outputs for inputs seen before
 
-# Add hydrogens and prepare the system
-mol = addions mol Na+ 0
-mol = addions mol Cl- 0
+        input_hash is the _input_hash of pdb_file, if the caller already has it.
+        """
+        if not self.settings.cache_dir:
+            return await self._prepare_system_internal(
+                tmpdir, pdb_file, force_field, water_model
+            )
 
-# Save parameter and coordinate files
-saveamberparm mol system.prmtop system.inpcrd
+        cache_dir = Path(self.settings.cache_dir)
+        if input_hash is None:
+            input_hash = await asyncio.to_thread(_input_hash, pdb_file)
+        key = _system_cache_key(input_hash, force_field, water_model)
 
-# Save as PDB for visualization
-savepdb mol prepared.pdb
+        log = await asyncio.to_thread(self._load_cached_system, cache_dir / key, tmpdir)
+        if log is not None:
+            logger.info(f"Using cached prepared system {key}")
+            return {"success": True, "log": log, "system_id": key}
 
-quit
-"""
-            tleap_script.write_text(script_content)
+        result = await self._prepare_system_internal(
+            tmpdir, pdb_file, force_field, water_model
+        )
+        if result["success"]:
+            try:
+                await asyncio.to_thread(
+                    self._store_cached_system,
+                    cache_dir,
+                    key,
+                    tmpdir,
+                    result["log"],
+                    input_hash,
+                    force_field,
+                    water_model,
+                )
+                result["system_id"] = key
+            except OSError as e:
+                logger.warning(f"Failed to cache prepared system: {e}")
+        return result
+
+    def _get_session_dir(self) -> Path:
+        """Directory holding systems prepared during this server session.
+
+        It lives in the system temp directory rather than temp_dir (RAM-backed /dev/shm
+        by default), since it outlives requests and leaks if the server is killed.
+        """
+        if self._session_dir is None:
+            self._session_dir = Path(tempfile.mkdtemp(prefix="bio-mcp-amber-session-"))
+        return self._session_dir
+
+    def _find_prepared_system(self, system_id: str) -> Optional[Path]:
+        """Locate a prepared system by ID in the cache or the session directory"""
+        stores = [Path(self.settings.cache_dir)] if self.settings.cache_dir else []
+        if self._session_dir is not None:
+            stores.append(self._session_dir)
+        for store in stores:
+            if (store / system_id).is_dir():
+                return store / system_id
+        return None
+
+    async def _load_prepared_system(self, entry: Path, tmpdir: Path) -> dict:
+        """Link a system from amber_prepare_system into tmpdir rather than run tleap"""
+        log = await asyncio.to_thread(self._load_cached_system, entry, tmpdir)
+        if log is None:
+            return {
+                "success": False,
+                "error": f"Prepared system not found: {entry.name}",
+            }
+        return {"success": True, "log": log, "system_id": entry.name}
+
+    def _load_cached_system(self, entry: Path, tmpdir: Path) -> Optional[str]:
+        """Link a cached prepared system into tmpdir, returning its tleap log or None"""
+        staged = []
+        try:
+            for name in CACHED_SYSTEM_FILES:
+                _stage_input(entry / name, tmpdir / name)
+                staged.append(tmpdir / name)
+            log = (entry / "tleap.log").read_text()
+            os.utime(entry)  # mark as recently used
+            return log
+        except FileNotFoundError:
+            # An entry evicted mid-load; drop the links so tleap writes fresh files
+            # rather than overwriting other cached entries' hardlinked inodes
+            for path in staged:
+                path.unlink(missing_ok=True)
+            return None
+
+    def _store_cached_system(
+        self,
+        cache_dir: Path,
+        key: str,
+        tmpdir: Path,
+        log: str,
+        input_hash: str,
+        force_field: str,
+        water_model: str,
+    ) -> None:
+        """Atomically publish tleap outputs into the cache and enforce the size cap"""
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=".tmp-", dir=cache_dir))
+        try:
+            for name in CACHED_SYSTEM_FILES:
+                _stage_input(tmpdir / name, staging / name)
+            (staging / "tleap.log").write_text(log)
+            # Lets amber_relax_pdb check that a prepared_system_id matches its request
+            metadata = {
+                "force_field": force_field,
+                "water_model": water_model,
+                "input_hash": input_hash,
+            }
+            (staging / "system.json").write_text(json.dumps(metadata))
+            os.rename(staging, cache_dir / key)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            # Another request may have published the same key first
+            if not (cache_dir / key).is_dir():
+                raise
+        max_bytes = self.settings.cache_max_bytes
+        if cache_dir == self._session_dir:
+            max_bytes = self.settings.session_max_bytes
+        _evict_lru(cache_dir, max_bytes)
+
+    async def _prepare_system_internal(self, tmpdir: Path, pdb_file: Path, force_field: str, water_model: str) -> dict:
+        """Internal method to prepare AMBER system using tleap"""
+        if self._tleap_pool is not None:
+            return await self._prepare_system_pooled(
+                tmpdir, pdb_file, force_field, water_model
+            )
+
+        try:
+            # Create tleap script
+            tleap_script = tmpdir / "prep.leap"
+            script_content = TLEAP_SCRIPT_TEMPLATE.format(
+                force_field=force_field, water_model=water_model
+            )
+            await asyncio.to_thread(tleap_script.write_text, script_content)
             
             # Run tleap
-            cmd = [self.settings.tleap_path, "-f", str(tleap_script)]
+            cmd = [self._tleap, "-f", str(tleap_script)]
             
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=tmpdir
-            )
-            
-            try:
-                stdout, stderr = await asyncio.wait_for(
-                    process.communicate(),
-                    timeout=self.settings.timeout
-                )
-            except asyncio.TimeoutError:
-                process.kill()
+            returncode = await self._run_tool(cmd, tmpdir, "tleap")
+            if returncode is None:
                 return {"success": False, "error": f"tleap timed out after {self.settings.timeout} seconds"}
             
-            if process.returncode != 0:
-                return {"success": False, "error": f"tleap failed: {stderr.decode()}"}
+            if returncode != 0:
+                stderr = await asyncio.to_thread(_read_tail, tmpdir / "tleap.stderr")
+                return {"success": False, "error": f"tleap failed: {stderr}"}
             
-            return {"success": True, "log": stdout.decode()}
+            log = await asyncio.to_thread(
+                (tmpdir / "tleap.stdout").read_text, errors="replace"
+            )
+            return {"success": True, "log": log}
             
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    async def _run_minimization(self, tmpdir: Path, steps: int, restraints: bool) -> dict:
+    async def _prepare_system_pooled(
+        self, tmpdir: Path, pdb_file: Path, force_field: str, water_model: str
+    ) -> dict:
+        """Prepare AMBER system on a warm tleap worker with the force field loaded"""
+        try:
+            # Workers run in their own directory, so use absolute paths
+            tmpdir = tmpdir.resolve()
+            tleap_script = tmpdir / "prep.leap"
+            mol = f"mol{next(self._leap_ids)}"
+            script_content = (TLEAP_SYSTEM_TEMPLATE.format(mol=mol, dir=tmpdir)
+                              + TLEAP_CLEAR_TEMPLATE.format(mols=mol))
+            await asyncio.to_thread(tleap_script.write_text, script_content)
+
+            try:
+                log = await self._tleap_pool.source(
+                    tleap_script, force_field, water_model
+                )
+            except TleapWorkerError as e:
+                return {"success": False, "error": str(e)}
+
+            # A persistent tleap does not exit on errors; check its log and outputs
+            if TLEAP_ERROR_LINE.search(log) or not await asyncio.to_thread(
+                _has_system_outputs, tmpdir
+            ):
+                return {
+                    "success": False,
+                    "error": f"tleap failed: {log[-LOG_PREVIEW_BYTES:]}",
+                }
+
+            return {"success": True, "log": log}
+
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    async def _prepare_systems_batch(
+        self, tmpdir: Path, pdb_files: list[Path], force_field: str, water_model: str
+    ) -> list[dict]:
+        """Prepare several systems, each in its PDB's directory, in one tleap run"""
+        results: list[Optional[dict]] = [None] * len(pdb_files)
+
+        # Reuse cached systems and only run tleap for the rest
+        keys = [None] * len(pdb_files)
+        input_hashes = [None] * len(pdb_files)
+        if self.settings.cache_dir:
+            cache_dir = Path(self.settings.cache_dir)
+            for i, pdb_file in enumerate(pdb_files):
+                input_hashes[i] = await asyncio.to_thread(_input_hash, pdb_file)
+                keys[i] = _system_cache_key(input_hashes[i], force_field, water_model)
+                log = await asyncio.to_thread(
+                    self._load_cached_system, cache_dir / keys[i], pdb_file.parent
+                )
+                if log is not None:
+                    results[i] = {"success": True, "log": log}
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+
+        try:
+            tmpdir = tmpdir.resolve()
+            # Each system gets its own script, sourced from the batch script so that
+            # tleap brackets its output, and its own unit variable so one that fails
+            # to load cannot save another's
+            mols = [f"mol{next(self._leap_ids)}" for _ in pending]
+            body = ""
+            for mol, i in zip(mols, pending):
+                workdir = pdb_files[i].parent.resolve()
+                system_script = workdir / "prep.leap"
+                await asyncio.to_thread(
+                    system_script.write_text,
+                    TLEAP_SYSTEM_TEMPLATE.format(mol=mol, dir=workdir),
+                )
+                body += f'source "{system_script}"\n'
+            tleap_script = tmpdir / "prep.leap"
+
+            if self._tleap_pool is not None:
+                body += TLEAP_CLEAR_TEMPLATE.format(mols=" ".join(mols))
+                await asyncio.to_thread(tleap_script.write_text, body)
+                try:
+                    log = await self._tleap_pool.source(
+                        tleap_script, force_field, water_model
+                    )
+                except TleapWorkerError as e:
+                    log, error = None, str(e)
+            else:
+                script_content = TLEAP_SOURCE_TEMPLATE.format(
+                    force_field=force_field, water_model=water_model
+                )
+                await asyncio.to_thread(
+                    tleap_script.write_text, script_content + body + "quit\n"
+                )
+                returncode = await self._run_tool(
+                    [self._tleap, "-f", str(tleap_script)], tmpdir, "tleap"
+                )
+                if returncode is None:
+                    log = None
+                    error = f"tleap timed out after {self.settings.timeout} seconds"
+                else:
+                    log = await asyncio.to_thread(
+                        (tmpdir / "tleap.stdout").read_text, errors="replace"
+                    )
+        except Exception as e:
+            log, error = None, str(e)
+
+        for i in pending:
+            if log is None:
+                results[i] = {"success": False, "error": error}
+                continue
+
+            # tleap carries on past a bad structure; judge each system by its own output
+            workdir = pdb_files[i].parent
+            system_log = _sourced_output(log, workdir.resolve() / "prep.leap")
+            if TLEAP_ERROR_LINE.search(system_log) or not await asyncio.to_thread(
+                _has_system_outputs, workdir
+            ):
+                error = (system_log or log)[-LOG_PREVIEW_BYTES:]
+                results[i] = {"success": False, "error": f"tleap failed: {error}"}
+                continue
+
+            results[i] = {"success": True, "log": system_log}
+            if keys[i] is not None:
+                try:
+                    await asyncio.to_thread(
+                        self._store_cached_system,
+                        cache_dir,
+                        keys[i],
+                        workdir,
+                        system_log,
+                        input_hashes[i],
+                        force_field,
+                        water_model,
+                    )
+                except OSError as e:
+                    logger.warning(f"Failed to cache prepared system: {e}")
+
+        return results
+
+    async def _write_min_inputs(
+        self, tmpdir: Path, steps: int, restraints: bool
+    ) -> None:
+        """Write the pmemd minimization input and restraint files"""
+        template = RESTRAINED_MIN_INPUT_TEMPLATE if restraints else MIN_INPUT_TEMPLATE
+        await asyncio.to_thread(
+            (tmpdir / "min.in").write_text,
+            template.format(steps=steps, ncyc=steps // 2),
+        )
+
+        # Create restraint file if needed
+        if restraints:
+            await asyncio.to_thread(
+                (tmpdir / "restraints.rst").write_text, RESTRAINT_FILE
+            )
+
+    async def _run_minimization(self, tmpdir: Path, steps: int, restraints: bool,
+                                inputs_written: bool = False) -> dict:
         """Internal method to run AMBER energy minimization"""
         try:
-            # Create minimization input file
-            min_input = tmpdir / "min.in"
-            input_content = f"""Energy minimization
-&cntrl
-  imin=1,       ! Minimize energy
-  maxcyc={steps}, ! Maximum cycles
-  ncyc={steps//2}, ! Initial steepest descent steps
-  ntb=0,        ! No periodic boundaries
-  cut=999.0,    ! No cutoff
-"""
-            if restraints:
-                input_content += "  ntr=1,        ! Apply restraints\n"
-                input_content += "  restraint_wt=10.0, ! Restraint weight\n"
-                input_content += "  restraintmask='@CA,C,N', ! Restrain backbone atoms\n"
-            
-            input_content += "&end\n"
-            min_input.write_text(input_content)
-            
-            # Create restraint file if needed
-            if restraints:
-                rst_file = tmpdir / "restraints.rst"
-                rst_content = """Hold backbone atoms fixed
-10.0
-RES 1 999
-END
-END
-"""
-                rst_file.write_text(rst_content)
+            if not inputs_written:
+                await self._write_min_inputs(tmpdir, steps, restraints)
             
             # Run pmemd for minimization
             cmd = [
-                self.settings.pmemd_path,
+                self._pmemd,
                 "-O",
                 "-i", "min.in",
                 "-o", "minimization.log",
@@ -302,65 +1451,178 @@ END
                 "-r", "minimized.rst",
                 "-ref", "system.inpcrd"
             ]
+            if self._pmemd_is_cuda:
+                cmd.append("-AllowSmallBox")
             
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=tmpdir
-            )
-            
-            try:
-                stdout, stderr = await asyncio.wait_for(
-                    process.communicate(),
-                    timeout=self.settings.timeout
+            async with self._acquire_gpu() as gpu:
+                returncode = await self._run_tool(
+                    cmd, tmpdir, "pmemd", env=self._subprocess_env(gpu)
                 )
-            except asyncio.TimeoutError:
-                process.kill()
+            if returncode is None:
                 return {"success": False, "error": f"Minimization timed out after {self.settings.timeout} seconds"}
             
-            if process.returncode != 0:
-                return {"success": False, "error": f"pmemd failed: {stderr.decode()}"}
+            if returncode != 0:
+                stderr = await asyncio.to_thread(_read_tail, tmpdir / "pmemd.stderr")
+                return {"success": False, "error": f"pmemd failed: {stderr}"}
             
             # Convert final structure to PDB
             await self._convert_to_pdb(tmpdir)
             
-            return {"success": True, "log": stdout.decode()}
+            return {
+                "success": True,
+                "log": await asyncio.to_thread(_read_tail, tmpdir / "pmemd.stdout"),
+            }
             
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    async def _convert_to_pdb(self, tmpdir: Path) -> None:
-        """Convert AMBER restart file to PDB format using cpptraj"""
+    async def _relax_pdb_openmm(
+        self,
+        tmpdir: Path,
+        pdb_file: Path,
+        force_field: str,
+        water_model: str,
+        steps: int,
+        restraints: bool,
+    ) -> dict:
+        """Minimize a PDB in-process with OpenMM's AMBER force fields"""
+
         try:
-            # Create cpptraj script
-            cpptraj_script = tmpdir / "convert.cpptraj"
-            script_content = """parm system.prmtop
-trajin minimized.rst
-trajout minimized.pdb pdb
-run
-quit
-"""
-            cpptraj_script.write_text(script_content)
-            
-            # Run cpptraj
-            cmd = ["cpptraj", "-i", "convert.cpptraj"]
-            
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=tmpdir
+            import openmm  # noqa: F401
+        except ImportError:
+            return {
+                "success": False,
+                "error": (
+                    "OpenMM backend requires the openmm package "
+                    "(pip install bio-mcp-amber[openmm])"
+                ),
+            }
+
+        try:
+            return await asyncio.to_thread(
+                self._minimize_openmm,
+                tmpdir,
+                pdb_file,
+                force_field,
+                water_model,
+                steps,
+                restraints,
+            )
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    def _minimize_openmm(
+        self,
+        tmpdir: Path,
+        pdb_file: Path,
+        force_field: str,
+        water_model: str,
+        steps: int,
+        restraints: bool,
+    ) -> dict:
+        """Blocking OpenMM minimization, run in a worker thread"""
+        import openmm
+        from openmm import app, unit
+
+        files = _openmm_force_field_files(force_field, water_model)
+        if files is None:
+            error = f"OpenMM does not bundle {force_field} with {water_model} water"
+            return {"success": False, "error": error}
+
+        pdb = app.PDBFile(str(pdb_file))
+        forcefield = app.ForceField(*files)
+
+        # Add hydrogens and build the system (no periodic boundaries, no cutoff)
+        modeller = app.Modeller(pdb.topology, pdb.positions)
+        modeller.addHydrogens(forcefield)
+        system = forcefield.createSystem(
+            modeller.topology, nonbondedMethod=app.NoCutoff, constraints=None
+        )
+
+        if restraints:
+            # Restrain backbone atoms to their starting positions
+            restraint = openmm.CustomExternalForce("k*((x-x0)^2+(y-y0)^2+(z-z0)^2)")
+            k = 10.0 * unit.kilocalories_per_mole / unit.angstroms**2
+            restraint.addGlobalParameter(
+                "k", k.value_in_unit(unit.kilojoules_per_mole / unit.nanometers**2)
             )
+            for name in ("x0", "y0", "z0"):
+                restraint.addPerParticleParameter(name)
+            for atom in modeller.topology.atoms():
+                if atom.name in ("CA", "C", "N"):
+                    restraint.addParticle(
+                        atom.index,
+                        modeller.positions[atom.index].value_in_unit(unit.nanometers),
+                    )
+            system.addForce(restraint)
+
+        # Prefer GPU platforms, falling back to CPU
+        context = None
+        platform_name = None
+        for platform_name in ("CUDA", "OpenCL", "CPU"):
+            try:
+                platform = openmm.Platform.getPlatformByName(platform_name)
+                # A Context owns its integrator, so each attempt needs a fresh one
+                integrator = openmm.VerletIntegrator(0.001 * unit.picoseconds)
+                context = openmm.Context(system, integrator, platform)
+                break
+            except Exception:
+                continue
+        if context is None:
+            return {"success": False, "error": "No usable OpenMM platform found"}
+
+        context.setPositions(modeller.positions)
+        initial = context.getState(getEnergy=True).getPotentialEnergy()
+        openmm.LocalEnergyMinimizer.minimize(context, maxIterations=steps)
+        state = context.getState(getEnergy=True, getPositions=True)
+        final = state.getPotentialEnergy()
+
+        with open(tmpdir / "minimized.pdb", "w") as f:
+            app.PDBFile.writeFile(modeller.topology, state.getPositions(), f)
+
+        initial_kcal = initial.value_in_unit(unit.kilocalories_per_mole)
+        final_kcal = final.value_in_unit(unit.kilocalories_per_mole)
+        log = (
+            f"OpenMM minimization on {platform_name} platform\n"
+            f"Initial potential energy: {initial_kcal:.4f} kcal/mol\n"
+            f"Final potential energy: {final_kcal:.4f} kcal/mol\n"
+        )
+
+        (tmpdir / "minimization.log").write_text(log)
+
+        return {"success": True, "log": log}
+
+    async def _convert_to_pdb(self, tmpdir: Path) -> None:
+        """Convert AMBER restart file to PDB format using ambpdb"""
+        try:
+            # ambpdb writes the PDB to stdout, which _run_tool streams to ambpdb.stdout
+            cmd = [self._ambpdb, "-p", "system.prmtop", "-c", "minimized.rst"]
             
-            await process.communicate()
+            returncode = await self._run_tool(cmd, tmpdir, "ambpdb")
+            if returncode is None:
+                logger.warning(
+                    f"ambpdb timed out after {self.settings.timeout} seconds"
+                )
+            elif returncode != 0:
+                stderr = await asyncio.to_thread(_read_tail, tmpdir / "ambpdb.stderr")
+                logger.warning(f"ambpdb failed: {stderr}")
+            else:
+                await asyncio.to_thread(
+                    os.replace, tmpdir / "ambpdb.stdout", tmpdir / "minimized.pdb"
+                )
             
         except Exception as e:
             logger.warning(f"Failed to convert to PDB: {e}")
     
     async def run(self):
-        async with stdio_server() as (read_stream, write_stream):
-            await self.server.run(read_stream, write_stream)
+        try:
+            async with stdio_server() as (read_stream, write_stream):
+                await self.server.run(read_stream, write_stream)
+        finally:
+            if self._tleap_pool is not None:
+                await self._tleap_pool.close()
+            if self._session_dir is not None:
+                shutil.rmtree(self._session_dir, ignore_errors=True)
 
 
 async def main():
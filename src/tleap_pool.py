@@ -0,0 +1,183 @@
+"""
+Persistent tleap worker pool for Bio-MCP AMBER server.
+
+Starting tleap and sourcing the protein and water leaprc files dominates the cost
+of preparing small systems. This module keeps warm tleap processes with the force
+field already loaded and feeds them per-request scripts over stdin.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TleapWorkerError(Exception):
+    """Raised when a tleap worker dies or stops responding."""
+
+
+class TleapWorker:
+    """A single tleap process with one force field and water model pre-sourced."""
+
+    def __init__(self, tleap_path: str, force_field: str, water_model: str,
+                 spawn_options: Optional[Dict[str, Any]] = None):
+        self.tleap_path = tleap_path
+        self.force_field = force_field
+        self.water_model = water_model
+        self.spawn_options = spawn_options or {}
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._workdir: Optional[Path] = None
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.returncode is None
+
+    async def start(self, timeout: float) -> str:
+        """Spawn tleap and source the force field; returns the startup log."""
+        self._workdir = Path(tempfile.mkdtemp(prefix="tleap-worker-"))
+        self._process = await asyncio.create_subprocess_exec(
+            self.tleap_path,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            cwd=self._workdir,
+            **self.spawn_options,
+        )
+
+        init_script = self._workdir / "init.leap"
+        init_script.write_text(
+            f"source leaprc.protein.{self.force_field}\n"
+            f"source leaprc.water.{self.water_model}\n"
+        )
+        return await self.source(init_script, timeout)
+
+    async def source(self, script: Path, timeout: float) -> str:
+        """Source a leap script and return the output it produced.
+
+        tleap reports "----- Source of <file> done" once a sourced file has been
+        processed, which delimits the output of each request.
+        """
+        if not self.alive:
+            raise TleapWorkerError("tleap worker is not running")
+
+        script = script.resolve()
+        marker = f"Source of {script} done"
+        self._process.stdin.write(f'source "{script}"\n'.encode())
+
+        try:
+            await self._process.stdin.drain()
+            return await asyncio.wait_for(self._read_until(marker), timeout=timeout)
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            await self.close()
+            reason = str(e) or "timed out"
+            raise TleapWorkerError(f"tleap worker failed: {reason}") from e
+        except BaseException:
+            # Cancelled mid-script: the rest of its output would reach the next
+            # request, and it may still be writing into the caller's directory
+            await self.kill()
+            raise
+
+    async def _read_until(self, marker: str) -> str:
+        lines = []
+        while True:
+            line = await self._process.stdout.readline()
+            if not line:
+                raise ConnectionError("tleap exited")
+            text = line.decode(errors="replace")
+            lines.append(text)
+            if marker in text:
+                return "".join(lines)
+
+    async def close(self) -> None:
+        if self.alive:
+            try:
+                self._process.stdin.write(b"quit\n")
+                await self._process.stdin.drain()
+                await asyncio.wait_for(self._process.wait(), timeout=5)
+            except (asyncio.TimeoutError, ConnectionError):
+                self._kill()
+                await self._process.wait()
+        self._cleanup()
+
+    async def kill(self) -> None:
+        """Stop the worker immediately, without letting it finish its current script."""
+        if self.alive:
+            self._kill()
+            await self._process.wait()
+        self._cleanup()
+
+    def _cleanup(self) -> None:
+        self._process = None
+        if self._workdir is not None:
+            shutil.rmtree(self._workdir, ignore_errors=True)
+            self._workdir = None
+
+    def _kill(self) -> None:
+        # tleap is a wrapper script; in its own session the whole group can be killed
+        if self.spawn_options.get("start_new_session"):
+            try:
+                os.killpg(self._process.pid, signal.SIGKILL)
+                return
+            except (ProcessLookupError, PermissionError):
+                pass
+        self._process.kill()
+
+
+class TleapPool:
+    """Pool of warm tleap workers, keyed by force field and water model."""
+
+    def __init__(self, tleap_path: str, size: int, timeout: float,
+                 spawn_options: Optional[Dict[str, Any]] = None):
+        self.tleap_path = tleap_path
+        self.size = size
+        self.timeout = timeout
+        # Extra create_subprocess_exec arguments for the workers
+        self.spawn_options = spawn_options
+        # Each queue holds `size` slots: an idle worker, or None if one must be spawned
+        self._slots: Dict[Tuple[str, str], asyncio.Queue] = {}
+        self._workers: List[TleapWorker] = []
+
+    async def source(self, script: Path, force_field: str, water_model: str) -> str:
+        """Run a leap script on a worker with the given force field loaded."""
+        key = (force_field, water_model)
+        slots = self._slots.get(key)
+        if slots is None:
+            slots = self._slots[key] = asyncio.Queue()
+            for _ in range(self.size):
+                slots.put_nowait(None)
+
+        worker = await slots.get()
+        try:
+            if worker is None or not worker.alive:
+                worker = await self._spawn(force_field, water_model)
+            return await worker.source(script, self.timeout)
+        finally:
+            # Dead workers give their slot back empty and are replaced on demand
+            if worker is not None and not worker.alive:
+                self._workers.remove(worker)
+                worker = None
+            slots.put_nowait(worker)
+
+    async def _spawn(self, force_field: str, water_model: str) -> TleapWorker:
+        worker = TleapWorker(
+            self.tleap_path, force_field, water_model, self.spawn_options
+        )
+        try:
+            await worker.start(self.timeout)
+        except BaseException:
+            await worker.close()
+            raise
+        self._workers.append(worker)
+        logger.info(f"Started tleap worker for {force_field}/{water_model}")
+        return worker
+
+    async def close(self) -> None:
+        await asyncio.gather(*(worker.close() for worker in self._workers))
+        self._workers.clear()
+        self._slots.clear()
@@ -1,20 +1,52 @@
-import pytest
-from pathlib import Path
-from unittest.mock import AsyncMock, patch, MagicMock
+import asyncio
+import json
+import os
+import re
+import shutil
 import tempfile
+from pathlib import Path
+from typing import Optional
+from unittest.mock import AsyncMock, MagicMock, patch
 
-from src.server import AmberServer, ServerSettings
+import pytest
 from mcp.types import ErrorData, TextContent
 
+from src.server import (
+    MAX_BATCH_FILES,
+    PDB_CHECK_BYTES,
+    AmberServer,
+    ServerSettings,
+    _detect_gpus,
+    _evict_lru,
+    _head_and_size,
+    _input_hash,
+    _quick_pdb_check,
+    _read_tail,
+    _stage_input,
+)
+
+# A minimal PDB with one coordinate record
+ATOM_RECORD = (
+    "ATOM      1  N   ALA A   1      20.154  16.967  18.587  1.00 16.77           N\n"
+)
+PDB_TEXT = ATOM_RECORD + "END\n"
+RELAXED_ATOM_RECORD = (
+    "ATOM      1  N   ALA A   1      20.000  17.000  18.500  1.00 16.77           N"
+)
+
 
 @pytest.fixture
 def server():
     settings = ServerSettings(
         tleap_path="mock_tleap",
         pmemd_path="mock_pmemd",
+        pmemd_cuda_path="mock_pmemd_cuda",
         temp_dir=tempfile.gettempdir()
     )
-    return AmberServer(settings)
+    server = AmberServer(settings)
+    yield server
+    if server._session_dir is not None:
+        shutil.rmtree(server._session_dir, ignore_errors=True)
 
 
 @pytest.mark.skip(reason="MCP Server list_tools() decorator testing not implemented")
@@ -93,7 +125,7 @@ END
     async def mock_prepare_system(tmpdir, pdb_file, force_field, water_model):
         return {"success": True, "log": "tleap executed successfully"}
     
-    async def mock_run_minimization(tmpdir, steps, restraints):
+    async def mock_run_minimization(tmpdir, steps, restraints, inputs_written=False):
         # Create mock output files
         log_file = tmpdir / "minimization.log"
         log_file.write_text("Minimization completed successfully")
@@ -132,8 +164,11 @@ END
     with patch("asyncio.create_subprocess_exec") as mock_exec:
         mock_process = AsyncMock()
         mock_process.returncode = 0
-        mock_process.communicate.return_value = (b"tleap output", b"")
-        mock_exec.return_value = mock_process
+
+        def fake_exec(*cmd, stdout, stderr, **kwargs):
+            stdout.write(b"tleap output")
+            return mock_process
+        mock_exec.side_effect = fake_exec
         
         result = await server._prepare_system_internal(tmp_path, pdb_file, "ff19SB", "tip3p")
         
@@ -161,8 +196,11 @@ async def test_run_minimization_success(server, tmp_path):
         
         mock_process = AsyncMock()
         mock_process.returncode = 0
-        mock_process.communicate.return_value = (b"pmemd output", b"")
-        mock_exec.return_value = mock_process
+
+        def fake_exec(*cmd, stdout, stderr, **kwargs):
+            stdout.write(b"pmemd output")
+            return mock_process
+        mock_exec.side_effect = fake_exec
         
         result = await server._run_minimization(tmp_path, 1000, False)
         
@@ -201,4 +239,983 @@ async def test_invalid_input_arguments(server):
     result = await server._relax_pdb({})  # Missing required input_file
     assert len(result) == 1
     assert hasattr(result[0], 'message')
-    # This should trigger a KeyError or similar validation error
\ No newline at end of file
+    # This should trigger a KeyError or similar validation error
+
+
+def test_select_pmemd_prefers_cuda_when_available():
+    settings = ServerSettings(
+        pmemd_path="mock_pmemd", pmemd_cuda_path="mock_pmemd_cuda"
+    )
+    with patch("shutil.which", return_value="/usr/bin/mock_pmemd_cuda"):
+        server = AmberServer(settings)
+    assert server._pmemd == "/usr/bin/mock_pmemd_cuda"
+
+
+def test_select_pmemd_falls_back_to_cpu(server):
+    # mock_pmemd_cuda is not on PATH, so the CPU binary is used
+    assert server._pmemd == "mock_pmemd"
+
+    settings = ServerSettings(pmemd_path="mock_pmemd", use_gpu=False)
+    with patch(
+        "shutil.which",
+        side_effect=lambda name: (
+            "/usr/bin/pmemd.cuda" if name == "pmemd.cuda" else None
+        ),
+    ):
+        assert AmberServer(settings)._pmemd == "mock_pmemd"
+
+
+def test_subprocess_env_pins_gpu():
+    settings = ServerSettings(cuda_visible_devices="1")
+    env = AmberServer(settings)._subprocess_env()
+    assert env["CUDA_VISIBLE_DEVICES"] == "1"
+
+
+@pytest.mark.asyncio
+async def test_relax_pdb_openmm_backend(tmp_path):
+    settings = ServerSettings(backend="openmm", temp_dir=tempfile.gettempdir())
+    server = AmberServer(settings)
+
+    input_file = tmp_path / "test.pdb"
+    input_file.write_text(PDB_TEXT)
+
+    async def mock_relax_openmm(
+        tmpdir, pdb_file, force_field, water_model, steps, restraints
+    ):
+        (tmpdir / "minimized.pdb").write_text(RELAXED_ATOM_RECORD)
+        return {"success": True, "log": "OpenMM minimization"}
+
+    with patch.object(server, "_relax_pdb_openmm",
+                      side_effect=mock_relax_openmm) as mock_openmm, \
+         patch.object(server, "_prepare_system_internal") as mock_prepare, \
+         patch.object(server, "_run_minimization") as mock_min:
+        result = await server._relax_pdb({"input_file": str(input_file), "steps": 100})
+
+        assert "AMBER PDB relaxation completed successfully" in result[0].text
+        mock_openmm.assert_called_once()
+        mock_prepare.assert_not_called()
+        mock_min.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_relax_pdb_openmm_missing_package(server, tmp_path):
+    with patch.dict("sys.modules", {"openmm": None}):
+        result = await server._relax_pdb_openmm(
+            tmp_path, tmp_path / "test.pdb", "ff19SB", "tip3p", 100, False
+        )
+    assert result["success"] is False
+    assert "openmm" in result["error"]
+
+
+@pytest.mark.asyncio
+async def test_relax_pdb_openmm_rejects_unsupported_force_field(tmp_path):
+    server = AmberServer(
+        ServerSettings(backend="openmm", temp_dir=tempfile.gettempdir())
+    )
+    input_file = tmp_path / "test.pdb"
+    input_file.write_text(PDB_TEXT)
+
+    result = await server._relax_pdb(
+        {"input_file": str(input_file), "force_field": "ff99SB"}
+    )
+    assert isinstance(result[0], ErrorData)
+    assert result[0].code == 400
+    assert "ff19SB" in result[0].message
+
+    result = await server._relax_pdb_batch(
+        {"input_files": [str(input_file)], "force_field": "ff99SB"}
+    )
+    assert result[0].code == 400
+
+
+# Capped alanine dipeptide (ACE-ALA-NME), heavy atoms only
+ALANINE_DIPEPTIDE_PDB = """\
+ATOM      1  CH3 ACE A   1       2.000   1.000   0.000  1.00  0.00           C
+ATOM      2  C   ACE A   1       3.500   1.000   0.000  1.00  0.00           C
+ATOM      3  O   ACE A   1       4.100   2.000   0.000  1.00  0.00           O
+ATOM      4  N   ALA A   2       4.200  -0.150   0.000  1.00  0.00           N
+ATOM      5  CA  ALA A   2       5.650  -0.150   0.000  1.00  0.00           C
+ATOM      6  C   ALA A   2       6.200   1.270   0.000  1.00  0.00           C
+ATOM      7  O   ALA A   2       5.450   2.250   0.000  1.00  0.00           O
+ATOM      8  CB  ALA A   2       6.150  -0.900   1.230  1.00  0.00           C
+ATOM      9  N   NME A   3       7.530   1.370   0.000  1.00  0.00           N
+ATOM     10  C   NME A   3       8.150   2.680   0.000  1.00  0.00           C
+END
+"""
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("force_field", ["ff14SB", "ff19SB"])
+async def test_relax_pdb_openmm_real_system(tmp_path, force_field):
+    pytest.importorskip("openmm")
+    server = AmberServer(
+        ServerSettings(backend="openmm", temp_dir=tempfile.gettempdir())
+    )
+    input_file = tmp_path / "dipeptide.pdb"
+    input_file.write_text(ALANINE_DIPEPTIDE_PDB)
+
+    result = await server._relax_pdb(
+        {
+            "input_file": str(input_file),
+            "force_field": force_field,
+            "steps": 50,
+            "restraints": True,
+        }
+    )
+
+    assert isinstance(result[0], TextContent), result[0]
+    energies = [
+        float(e)
+        for e in re.findall(r"potential energy: (-?[\d.]+) kcal/mol", result[0].text)
+    ]
+    assert len(energies) == 2
+    assert energies[1] < energies[0]
+    assert "CB  ALA" in result[0].text
+
+
+@pytest.mark.asyncio
+async def test_relax_pdb_truncates_large_structure(server, tmp_path):
+    input_file = tmp_path / "test.pdb"
+    input_file.write_text(PDB_TEXT)
+
+    async def mock_prepare_system(tmpdir, pdb_file, force_field, water_model):
+        return {"success": True, "log": "tleap executed successfully"}
+
+    async def mock_run_minimization(tmpdir, steps, restraints, inputs_written=False):
+        (tmpdir / "minimized.pdb").write_text("A" * 5000)
+        return {"success": True, "log": "pmemd executed successfully"}
+
+    with patch.object(server, "_prepare_system_internal",
+                      side_effect=mock_prepare_system), \
+         patch.object(server, "_run_minimization", side_effect=mock_run_minimization):
+        result = await server._relax_pdb({"input_file": str(input_file)})
+
+    assert "A" * 2000 in result[0].text
+    assert "A" * 2001 not in result[0].text
+    assert result[0].text.endswith("... (truncated)")
+
+
+def test_head_and_size(tmp_path):
+    path = tmp_path / "minimization.log"
+    path.write_text("x" * 100)
+
+    assert _head_and_size(path, 10) == ("x" * 10, 100)
+    assert _head_and_size(path, 1000) == ("x" * 100, 100)
+
+
+def test_stage_input_falls_back_to_copy(tmp_path):
+    src = tmp_path / "input.pdb"
+    src.write_text("ATOM")
+
+    linked = tmp_path / "linked.pdb"
+    _stage_input(src, linked)
+    assert linked.read_text() == "ATOM"
+
+    copied = tmp_path / "copied.pdb"
+    with patch("os.link", side_effect=OSError("cross-device link")):
+        _stage_input(src, copied)
+    assert copied.read_text() == "ATOM"
+
+
+def test_stage_input_large_file(tmp_path):
+    src = tmp_path / "input.pdb"
+    content = b"ATOM" * 3000 + b"END\n"  # not a multiple of the O_DIRECT alignment
+    src.write_bytes(content)
+    dst = tmp_path / "staged.pdb"
+
+    with patch("os.link", side_effect=OSError("cross-device link")), \
+         patch("src.server.DIRECT_IO_THRESHOLD", 1):
+        _stage_input(src, dst)
+
+    assert dst.read_bytes() == content
+
+
+@pytest.mark.asyncio
+async def test_prepare_system_cache_hit(tmp_path):
+    settings = ServerSettings(cache_dir=str(tmp_path / "cache"))
+    server = AmberServer(settings)
+
+    pdb_file = tmp_path / "test.pdb"
+    pdb_file.write_text(PDB_TEXT)
+
+    async def mock_prepare_system(tmpdir, pdb_file, force_field, water_model):
+        for name in ("system.prmtop", "system.inpcrd", "prepared.pdb"):
+            (tmpdir / name).write_text(name)
+        return {"success": True, "log": "tleap executed successfully"}
+
+    with patch.object(
+        server, "_prepare_system_internal", side_effect=mock_prepare_system
+    ) as mock_prepare:
+        first = tmp_path / "first"
+        first.mkdir()
+        result = await server._prepare_system_cached(first, pdb_file, "ff19SB", "tip3p")
+        assert result["success"] is True
+
+        second = tmp_path / "second"
+        second.mkdir()
+        result = await server._prepare_system_cached(
+            second, pdb_file, "ff19SB", "tip3p"
+        )
+        assert result["success"] is True
+        assert result["log"] == "tleap executed successfully"
+        assert (second / "system.prmtop").read_text() == "system.prmtop"
+        mock_prepare.assert_called_once()
+
+        # A different force field is a cache miss
+        third = tmp_path / "third"
+        third.mkdir()
+        await server._prepare_system_cached(third, pdb_file, "ff14SB", "tip3p")
+        assert mock_prepare.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_relax_pdb_cancels_preparation_when_inputs_fail(server, tmp_path):
+    input_file = tmp_path / "test.pdb"
+    input_file.write_text(PDB_TEXT)
+    cancelled = asyncio.Event()
+
+    async def slow_prepare(tmpdir, pdb_file, force_field, water_model):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def failing_inputs(tmpdir, steps, restraints):
+        raise OSError("disk full")
+
+    with patch.object(server, "_prepare_system_internal", side_effect=slow_prepare), \
+         patch.object(server, "_write_min_inputs", side_effect=failing_inputs):
+        result = await server._relax_pdb({"input_file": str(input_file)})
+        assert result[0].code == 500
+        assert "disk full" in result[0].message
+        assert cancelled.is_set()
+
+        result = await server._relax_pdb_batch({"input_files": [str(input_file)]})
+        assert result[0].code == 500
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", ["prepared.pdb", "system.prmtop", "input.pdb"])
+async def test_prepare_system_does_not_write_to_input(server, tmp_path, name):
+    content = PDB_TEXT
+    input_file = tmp_path / name
+    input_file.write_text(content)
+    # Same filesystem, so the input is hardlinked
+    server.settings.temp_dir = str(tmp_path)
+
+    async def mock_run_tool(cmd, tmpdir, tool, env=None):
+        assert "loadpdb input.pdb" in (tmpdir / "prep.leap").read_text()
+        for output in (
+            "system.prmtop",
+            "system.inpcrd",
+            "prepared.pdb",
+            "tleap.stdout",
+        ):
+            (tmpdir / output).write_text("tleap output")
+        return 0
+
+    with patch.object(server, "_run_tool", side_effect=mock_run_tool):
+        result = await server._prepare_system({"input_file": str(input_file)})
+
+    assert isinstance(result[0], TextContent)
+    assert input_file.read_text() == content
+
+
+@pytest.mark.asyncio
+async def test_prepare_system_hashes_input_once(tmp_path):
+    server = AmberServer(
+        ServerSettings(cache_dir=str(tmp_path / "cache"), temp_dir=str(tmp_path))
+    )
+    input_file = tmp_path / "test.pdb"
+    input_file.write_text(PDB_TEXT)
+
+    async def mock_prepare_system(tmpdir, pdb_file, force_field, water_model):
+        for name in ("system.prmtop", "system.inpcrd", "prepared.pdb"):
+            (tmpdir / name).write_text(name)
+        return {"success": True, "log": "tleap executed successfully"}
+
+    with patch.object(server, "_prepare_system_internal",
+                      side_effect=mock_prepare_system), \
+         patch("src.server._input_hash", wraps=_input_hash) as mock_hash:
+        result = await server._prepare_system({"input_file": str(input_file)})
+
+    assert "Prepared system ID" in result[0].text
+    mock_hash.assert_called_once()
+    entry = next((tmp_path / "cache").iterdir())
+    metadata = json.loads((entry / "system.json").read_text())
+    assert metadata["input_hash"] == _input_hash(input_file)
+
+
+
+def test_load_cached_system_partial_entry(server, tmp_path):
+    entry = tmp_path / "entry"
+    entry.mkdir()
+    (entry / "system.prmtop").write_text("cached prmtop")
+    (entry / "system.inpcrd").write_text("cached inpcrd")
+    tmpdir = tmp_path / "work"
+    tmpdir.mkdir()
+
+    # prepared.pdb is missing, so nothing may be left linked to the entry's files
+    assert server._load_cached_system(entry, tmpdir) is None
+    assert list(tmpdir.iterdir()) == []
+    assert (entry / "system.prmtop").read_text() == "cached prmtop"
+
+
+def test_evict_lru(tmp_path):
+    for i, name in enumerate(["old", "new"]):
+        entry = tmp_path / name
+        entry.mkdir()
+        (entry / "system.prmtop").write_bytes(b"x" * 100)
+        os.utime(entry, (i, i))
+
+    _evict_lru(tmp_path, 150)
+
+    assert not (tmp_path / "old").exists()
+    assert (tmp_path / "new").exists()
+
+
+def test_default_temp_dir():
+    with patch("os.path.isdir", return_value=True), \
+         patch("os.access", return_value=True):
+        assert ServerSettings().temp_dir == "/dev/shm"
+    with patch("os.path.isdir", return_value=False):
+        assert ServerSettings().temp_dir is None
+
+
+@pytest.mark.asyncio
+async def test_write_min_inputs(server, tmp_path):
+    await server._write_min_inputs(tmp_path, 1000, True)
+
+    min_input = (tmp_path / "min.in").read_text()
+    assert "maxcyc=1000" in min_input
+    assert "ncyc=500" in min_input
+    assert "ntpr=1000" in min_input
+    assert "ntr=1" in min_input
+    assert (tmp_path / "restraints.rst").exists()
+
+
+@pytest.mark.asyncio
+async def test_write_min_inputs_without_restraints(server, tmp_path):
+    await server._write_min_inputs(tmp_path, 1000, False)
+
+    min_input = (tmp_path / "min.in").read_text()
+    assert "maxcyc=1000" in min_input
+    assert "ntr=1" not in min_input
+    assert min_input.endswith("&end\n")
+    assert not (tmp_path / "restraints.rst").exists()
+
+
+@pytest.mark.asyncio
+async def test_prepare_system_internal_pooled(tmp_path):
+    server = AmberServer(ServerSettings(tleap_workers=1))
+    pdb_file = tmp_path / "test.pdb"
+    pdb_file.write_text(PDB_TEXT)
+
+    scripts = []
+
+    async def mock_source(script, force_field, water_model):
+        assert (force_field, water_model) == ("ff19SB", "tip3p")
+        content = script.read_text()
+        scripts.append(content)
+        assert "source leaprc" not in content
+        assert "quit" not in content
+        (tmp_path / "system.prmtop").write_text("prmtop")
+        (tmp_path / "system.inpcrd").write_text("inpcrd")
+        return "tleap output"
+
+    with patch.object(server._tleap_pool, "source", side_effect=mock_source), \
+         patch("asyncio.create_subprocess_exec") as mock_exec:
+        result = await server._prepare_system_internal(
+            tmp_path, pdb_file, "ff19SB", "tip3p"
+        )
+        await server._prepare_system_internal(tmp_path, pdb_file, "ff19SB", "tip3p")
+
+    assert result == {"success": True, "log": "tleap output"}
+    mock_exec.assert_not_called()
+
+    # Each request uses a fresh unit variable on the shared worker, then clears it
+    names = [
+        re.search(r"^(\w+) = loadpdb", content, re.MULTILINE).group(1)
+        for content in scripts
+    ]
+    assert names[0] != names[1]
+    for name, content in zip(names, scripts):
+        assert f"saveamberparm {name} " in content
+        assert f"clearVariables {{ {name} }}" in content
+
+
+@pytest.mark.asyncio
+async def test_prepare_system_pooled_reports_tleap_errors(tmp_path):
+    server = AmberServer(ServerSettings(tleap_workers=1))
+    pdb_file = tmp_path / "test.pdb"
+    pdb_file.write_text(PDB_TEXT)
+    # Outputs left over in the directory must not mask a failed run
+    (tmp_path / "system.prmtop").write_text("stale")
+    (tmp_path / "system.inpcrd").write_text("stale")
+
+    log = (
+        "Loading PDB file: ./test.pdb\n"
+        "FATAL:  Atom .R<ALA 1>.A<XX 1> does not have a type.\n"
+    )
+    with patch.object(server._tleap_pool, "source", AsyncMock(return_value=log)):
+        result = await server._prepare_system_internal(
+            tmp_path, pdb_file, "ff19SB", "tip3p"
+        )
+
+    assert result["success"] is False
+    assert "does not have a type" in result["error"]
+
+
+@pytest.mark.asyncio
+async def test_subprocess_options(server, tmp_path):
+    pdb_file = tmp_path / "test.pdb"
+    pdb_file.write_text(PDB_TEXT)
+
+    with patch("asyncio.create_subprocess_exec") as mock_exec:
+        mock_process = AsyncMock()
+        mock_process.returncode = 0
+        mock_exec.return_value = mock_process
+
+        await server._prepare_system_internal(tmp_path, pdb_file, "ff19SB", "tip3p")
+
+        kwargs = mock_exec.call_args[1]
+        assert kwargs["close_fds"] is False
+        assert kwargs["start_new_session"] is True
+
+
+@pytest.mark.asyncio
+async def test_run_tool_reaps_killed_processes(tmp_path):
+    server = AmberServer(ServerSettings(timeout=1))
+    processes = []
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def spy(*args, **kwargs):
+        process = await create_subprocess_exec(*args, **kwargs)
+        processes.append(process)
+        return process
+
+    with patch("asyncio.create_subprocess_exec", side_effect=spy):
+        assert await server._run_tool(["sleep", "30"], tmp_path, "sleep") is None
+        assert processes[-1].returncode == -9
+
+        # An abandoned request kills its tool too
+        task = asyncio.create_task(server._run_tool(["sleep", "30"], tmp_path, "sleep"))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert processes[-1].returncode == -9
+
+
+def test_tleap_pool_spawn_options():
+    server = AmberServer(ServerSettings(tleap_workers=1))
+    assert server._tleap_pool.spawn_options["start_new_session"] is True
+
+
+def test_executables_resolved_at_startup():
+    with patch("shutil.which", side_effect=lambda name: f"/opt/amber/bin/{name}"):
+        server = AmberServer(ServerSettings(use_gpu=False))
+    assert server._tleap == "/opt/amber/bin/tleap"
+    assert server._pmemd == "/opt/amber/bin/pmemd"
+    assert server._ambpdb == "/opt/amber/bin/ambpdb"
+
+
+@pytest.mark.asyncio
+async def test_prepare_system_internal_failure_reports_stderr(server, tmp_path):
+    pdb_file = tmp_path / "test.pdb"
+    pdb_file.write_text(PDB_TEXT)
+
+    with patch("asyncio.create_subprocess_exec") as mock_exec:
+        mock_process = AsyncMock()
+        mock_process.returncode = 1
+
+        def fake_exec(*cmd, stdout, stderr, **kwargs):
+            stderr.write(b"FATAL: Atom .R<ALA 1>.A<XX 6> does not have a type")
+            return mock_process
+
+        mock_exec.side_effect = fake_exec
+
+        result = await server._prepare_system_internal(
+            tmp_path, pdb_file, "ff19SB", "tip3p"
+        )
+
+    assert result["success"] is False
+    assert "does not have a type" in result["error"]
+
+
+def test_read_tail(tmp_path):
+    path = tmp_path / "pmemd.stderr"
+    path.write_text("head" + "x" * 100 + "tail")
+
+    assert _read_tail(path, 4) == "tail"
+    assert _read_tail(path, 1000) == "head" + "x" * 100 + "tail"
+
+
+@pytest.mark.asyncio
+async def test_convert_to_pdb(server, tmp_path):
+    with patch("asyncio.create_subprocess_exec") as mock_exec:
+        mock_process = AsyncMock()
+        mock_process.returncode = 0
+
+        def fake_exec(*cmd, stdout, stderr, **kwargs):
+            stdout.write(
+                b"ATOM      1  N   ALA     1      20.000  17.000  18.500"
+                b"  1.00  0.00           N\n"
+            )
+            return mock_process
+
+        mock_exec.side_effect = fake_exec
+
+        await server._convert_to_pdb(tmp_path)
+
+        call_args = mock_exec.call_args[0]
+        assert call_args[1:] == ("-p", "system.prmtop", "-c", "minimized.rst")
+
+    assert (tmp_path / "minimized.pdb").read_text().startswith("ATOM")
+
+
+@pytest.mark.asyncio
+async def test_prepare_system_reports_generated_files(server, tmp_path):
+    input_file = tmp_path / "test.pdb"
+    input_file.write_text(PDB_TEXT)
+
+    async def mock_prepare_system(tmpdir, pdb_file, force_field, water_model):
+        (tmpdir / "system.prmtop").write_text("x" * 42)
+        return {"success": True, "log": "tleap executed successfully"}
+
+    with patch.object(
+        server, "_prepare_system_internal", side_effect=mock_prepare_system
+    ):
+        result = await server._prepare_system({"input_file": str(input_file)})
+
+    assert "Parameter file generated: system.prmtop (42 bytes)" in result[0].text
+    assert "system.inpcrd" not in result[0].text
+
+
+@pytest.mark.asyncio
+async def test_relax_pdb_batch(server, tmp_path):
+    good = tmp_path / "good.pdb"
+    bad = tmp_path / "bad.pdb"
+    for input_file in (good, bad):
+        input_file.write_text(PDB_TEXT)
+
+    async def mock_run_tool(cmd, tmpdir, name, env=None):
+        # One tleap run prepares every system; only the first one succeeds
+        script = (tmpdir / "prep.leap").read_text()
+        assert script.count('source "') == 2
+        assert (tmpdir / "1" / "prep.leap").read_text().count("loadpdb") == 1
+        (tmpdir / "tleap.stdout").write_text("tleap output")
+        for output in ("system.prmtop", "system.inpcrd", "prepared.pdb"):
+            (tmpdir / "0" / output).write_text(output)
+        return 0
+
+    async def mock_run_minimization(tmpdir, steps, restraints, inputs_written=False):
+        assert (tmpdir / "min.in").exists()
+        (tmpdir / "minimized.pdb").write_text(RELAXED_ATOM_RECORD)
+        return {"success": True, "log": ""}
+
+    with patch.object(server, "_run_tool", side_effect=mock_run_tool) as mock_tool, \
+         patch.object(server, "_run_minimization",
+                      side_effect=mock_run_minimization) as mock_min:
+
+        result = await server._relax_pdb_batch(
+            {"input_files": [str(good), str(bad)], "steps": 100}
+        )
+
+    assert len(result) == 2
+    assert f"Input file: {good}" in result[0].text
+    assert "AMBER PDB relaxation completed successfully" in result[0].text
+    assert result[1].message.startswith(f"{bad}: System preparation failed")
+    mock_tool.assert_called_once()
+    mock_min.assert_called_once()
+
+
+def run_leap_script(script: str, units: Optional[dict] = None) -> str:
+    """Mimic tleap on the commands in TLEAP_SYSTEM_TEMPLATE: a unit is only defined if
+    its PDB loads, and tleap carries on past errors"""
+    units = {} if units is None else units
+    log = []
+    for line in script.splitlines():
+        if m := re.match(r'source "(.+)"', line):
+            log.append(f"----- Source: {m.group(1)}")
+            log.append(run_leap_script(Path(m.group(1)).read_text(), units))
+            log.append(f"----- Source of {m.group(1)} done")
+        elif m := re.match(r'(\w+) = loadpdb "(.+)"', line):
+            if "BAD" in Path(m.group(2)).read_text():
+                log.append(f"FATAL:  Could not load {m.group(2)}")
+            else:
+                units[m.group(1)] = m.group(2)
+        elif m := re.match(r'saveamberparm (\w+) "(.+)" "(.+)"', line):
+            if m.group(1) not in units:
+                log.append(
+                    "Error! saveamberparm: Argument #1 is type String "
+                    "must be of type: [unit]"
+                )
+                continue
+            Path(m.group(2)).write_text(units[m.group(1)])
+            Path(m.group(3)).write_text(units[m.group(1)])
+        elif (m := re.match(r'savepdb (\w+) "(.+)"', line)) and m.group(1) in units:
+            Path(m.group(2)).write_text(units[m.group(1)])
+    return "\n".join(log)
+
+
+@pytest.mark.asyncio
+async def test_relax_pdb_batch_isolates_failed_system(server, tmp_path):
+    inputs = [tmp_path / name for name in ("first.pdb", "bad.pdb", "third.pdb")]
+    for input_file in inputs:
+        input_file.write_text(PDB_TEXT)
+    inputs[1].write_text(inputs[1].read_text() + "REMARK BAD\n")
+
+    async def mock_run_tool(cmd, tmpdir, name, env=None):
+        (tmpdir / "tleap.stdout").write_text(
+            run_leap_script((tmpdir / "prep.leap").read_text())
+        )
+        return 0
+
+    async def mock_run_minimization(tmpdir, steps, restraints, inputs_written=False):
+        (tmpdir / "minimized.pdb").write_text((tmpdir / "system.prmtop").read_text())
+        return {"success": True, "log": ""}
+
+    with patch.object(server, "_run_tool", side_effect=mock_run_tool), \
+         patch.object(server, "_run_minimization", side_effect=mock_run_minimization):
+        result = await server._relax_pdb_batch(
+            {"input_files": [str(f) for f in inputs]}
+        )
+
+    # The failed system must not pick up the parameters of the system before it
+    assert isinstance(result[1], ErrorData)
+    assert result[1].message.startswith(f"{inputs[1]}: System preparation failed")
+    for i in (0, 2):
+        assert isinstance(result[i], TextContent)
+        assert result[i].text.endswith(f"/{i}/input.pdb")
+
+
+@pytest.mark.asyncio
+async def test_prepare_systems_batch_keeps_logs_per_system(tmp_path):
+    server = AmberServer(ServerSettings(cache_dir=str(tmp_path / "cache")))
+    pdb_files = []
+    for i, remark in enumerate(["", "REMARK BAD\n"]):
+        (tmp_path / str(i)).mkdir()
+        pdb_file = tmp_path / str(i) / "input.pdb"
+        pdb_file.write_text(ATOM_RECORD + remark)
+        pdb_files.append(pdb_file)
+
+    async def mock_run_tool(cmd, tmpdir, name, env=None):
+        (tmpdir / "tleap.stdout").write_text(
+            run_leap_script((tmpdir / "prep.leap").read_text())
+        )
+        return 0
+
+    with patch.object(server, "_run_tool", side_effect=mock_run_tool):
+        results = await server._prepare_systems_batch(
+            tmp_path, pdb_files, "ff19SB", "tip3p"
+        )
+
+    assert results[0]["success"] is True
+    assert "FATAL" not in results[0]["log"]
+    assert "1/input.pdb" not in results[0]["log"]
+    assert results[1]["success"] is False
+    assert "FATAL:  Could not load" in results[1]["error"]
+
+    # Only the system's own output is cached as its tleap log
+    (entry,) = (tmp_path / "cache").iterdir()
+    assert (entry / "tleap.log").read_text() == results[0]["log"]
+
+
+@pytest.mark.asyncio
+async def test_relax_pdb_batch_missing_file(server, tmp_path):
+    good = tmp_path / "good.pdb"
+    good.write_text(PDB_TEXT)
+
+    result = await server._relax_pdb_batch(
+        {"input_files": [str(good), "/nonexistent/file.pdb"]}
+    )
+    assert len(result) == 1
+    assert result[0].message.startswith("Input file not found")
+
+
+def test_quick_pdb_check(tmp_path):
+    pdb_file = tmp_path / "test.pdb"
+    pdb_file.write_text("REMARK test\n" + PDB_TEXT)
+    assert _quick_pdb_check(pdb_file) is None
+
+    no_atoms = tmp_path / "no_atoms.pdb"
+    no_atoms.write_text("REMARK nothing here\nEND\n")
+    assert "no ATOM or HETATM records" in _quick_pdb_check(no_atoms)
+
+    binary = tmp_path / "binary.pdb"
+    binary.write_bytes(b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR")
+    assert "non-ASCII" in _quick_pdb_check(binary)
+
+    # UTF-8 outside the record name columns is fine
+    utf8 = tmp_path / "utf8.pdb"
+    utf8.write_text(
+        "REMARK   1 AUTHOR J. M\u00fcller\n" + ATOM_RECORD,
+        encoding="utf-8",
+    )
+    assert _quick_pdb_check(utf8) is None
+
+
+def test_quick_pdb_check_long_header(tmp_path):
+    atom = ATOM_RECORD
+    remark = "REMARK  99 " + "x" * 69 + "\n"
+    pdb_file = tmp_path / "test.pdb"
+    for offset in range(-3, 4):
+        # Header over one chunk long, with ATOM landing on and around a chunk boundary
+
+        header = remark * (2 * PDB_CHECK_BYTES // len(remark) + 1)
+        header = header[: 2 * PDB_CHECK_BYTES + offset - 1] + "\n"
+        pdb_file.write_text(header + atom)
+        assert _quick_pdb_check(pdb_file) is None, offset
+
+
+@pytest.mark.asyncio
+async def test_relax_pdb_rejects_malformed_pdb(server, tmp_path):
+    input_file = tmp_path / "test.pdb"
+    input_file.write_text("this is not a pdb file\n")
+
+    with patch.object(server, "_prepare_system_internal") as mock_prepare:
+        result = await server._relax_pdb({"input_file": str(input_file)})
+
+    assert result[0].code == 400
+    assert "does not look like a PDB file" in result[0].message
+    mock_prepare.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_invalid_arguments_rejected_up_front(server):
+    with patch("src.server.logger") as mock_logger:
+        result = await server._relax_pdb({})
+        assert result[0].code == 400
+        assert "input_file" in result[0].message
+
+        result = await server._relax_pdb({"input_file": "test.pdb", "steps": "many"})
+        assert result[0].code == 400
+        assert "steps" in result[0].message
+
+        result = await server._prepare_system({"input_file": 42})
+        assert result[0].code == 400
+
+        result = await server._relax_pdb_batch({"input_files": []})
+        assert result[0].code == 400
+
+        result = await server._relax_pdb_batch(
+            {"input_files": ["test.pdb"] * (MAX_BATCH_FILES + 1)}
+        )
+        assert result[0].code == 400
+
+        for steps in (0, -5):
+            result = await server._relax_pdb({"input_file": "test.pdb", "steps": steps})
+            assert result[0].code == 400
+            assert "steps" in result[0].message
+
+        # Names end up in "source leaprc.protein.<force_field>"
+        result = await server._relax_pdb(
+            {"input_file": "test.pdb", "force_field": "ff19SB\nquit"}
+        )
+        assert result[0].code == 400
+        assert "force_field" in result[0].message
+
+        result = await server._prepare_system(
+            {"input_file": "test.pdb", "water_model": "tip3p; rm"}
+        )
+        assert result[0].code == 400
+        assert "water_model" in result[0].message
+
+    # Malformed requests do not go through the error logging path
+    mock_logger.error.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_relax_pdb_reuses_prepared_system(server, tmp_path):
+    input_file = tmp_path / "test.pdb"
+    input_file.write_text(PDB_TEXT)
+
+    async def mock_prepare_system(tmpdir, pdb_file, force_field, water_model):
+        for name in ("system.prmtop", "system.inpcrd", "prepared.pdb"):
+            (tmpdir / name).write_text(name)
+        return {"success": True, "log": "tleap executed successfully"}
+
+    async def mock_run_minimization(tmpdir, steps, restraints, inputs_written=False):
+        assert (tmpdir / "system.prmtop").read_text() == "system.prmtop"
+        (tmpdir / "minimized.pdb").write_text(RELAXED_ATOM_RECORD)
+        return {"success": True, "log": ""}
+
+    with patch.object(server, "_prepare_system_internal",
+                      side_effect=mock_prepare_system) as mock_prepare, \
+         patch.object(server, "_run_minimization", side_effect=mock_run_minimization):
+        result = await server._prepare_system({"input_file": str(input_file)})
+        system_id = re.search(r"Prepared system ID: ([0-9a-f]+)", result[0].text).group(
+            1
+        )
+
+        result = await server._relax_pdb(
+            {"input_file": str(input_file), "prepared_system_id": system_id}
+        )
+        assert "AMBER PDB relaxation completed successfully" in result[0].text
+        mock_prepare.assert_called_once()
+
+        result = await server._relax_pdb(
+            {"input_file": str(input_file), "prepared_system_id": "0" * 40}
+        )
+        assert result[0].code == 404
+
+        # The ID must belong to the same structure and force field
+        other_file = tmp_path / "other.pdb"
+        other_file.write_text(PDB_TEXT.replace("ALA", "GLY"))
+        result = await server._relax_pdb(
+            {"input_file": str(other_file), "prepared_system_id": system_id}
+        )
+        assert result[0].code == 400
+        assert "was not prepared from" in result[0].message
+
+        result = await server._relax_pdb(
+            {
+                "input_file": str(input_file),
+                "prepared_system_id": system_id,
+                "force_field": "ff14SB",
+            }
+        )
+        assert result[0].code == 400
+        assert "uses force field ff19SB" in result[0].message
+        mock_prepare.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_session_store_has_its_own_cap(tmp_path):
+    server = AmberServer(ServerSettings(temp_dir=str(tmp_path), session_max_bytes=1000))
+
+    async def mock_prepare_system(tmpdir, pdb_file, force_field, water_model):
+        for name in ("system.prmtop", "system.inpcrd", "prepared.pdb"):
+            (tmpdir / name).write_bytes(b"x" * 200)
+        return {"success": True, "log": "tleap executed successfully"}
+
+    try:
+        with patch.object(
+            server, "_prepare_system_internal", side_effect=mock_prepare_system
+        ):
+            for residue in ("ALA", "GLY"):
+                input_file = tmp_path / f"{residue}.pdb"
+                input_file.write_text(ATOM_RECORD.replace("ALA", residue))
+                await server._prepare_system({"input_file": str(input_file)})
+
+        # Kept out of temp_dir, and only the newest system fits under the cap
+        assert tmp_path not in server._session_dir.parents
+        assert len(list(server._session_dir.iterdir())) == 1
+    finally:
+        shutil.rmtree(server._session_dir, ignore_errors=True)
+
+
+@pytest.mark.asyncio
+async def test_relax_pdb_without_structure(server, tmp_path):
+    input_file = tmp_path / "test.pdb"
+    input_file.write_text(PDB_TEXT)
+
+    async def mock_prepare_system(tmpdir, pdb_file, force_field, water_model):
+        return {"success": True, "log": "tleap executed successfully"}
+
+    async def mock_run_minimization(tmpdir, steps, restraints, inputs_written=False):
+        (tmpdir / "minimization.log").write_text("Minimization completed successfully")
+        (tmpdir / "minimized.pdb").write_text("ATOM" * 10)
+        return {"success": True, "log": ""}
+
+    with patch.object(server, "_prepare_system_internal",
+                      side_effect=mock_prepare_system), \
+         patch.object(server, "_run_minimization", side_effect=mock_run_minimization):
+        result = await server._relax_pdb(
+            {"input_file": str(input_file), "include_structure": False}
+        )
+
+    assert "Minimization completed successfully" in result[0].text
+    assert "Relaxed structure: 40 bytes (coordinates omitted)" in result[0].text
+    assert "Final structure coordinates" not in result[0].text
+
+
+def test_detect_gpus_from_nvidia_smi():
+    output = "GPU 0: NVIDIA A100 (UUID: GPU-1)\nGPU 1: NVIDIA A100 (UUID: GPU-2)\n"
+    with patch.dict("sys.modules", {"pynvml": None}), \
+         patch("shutil.which", return_value="/usr/bin/nvidia-smi"), \
+         patch("subprocess.run", return_value=MagicMock(stdout=output)):
+        assert _detect_gpus() == ["0", "1"]
+
+
+def test_select_gpus_respects_inherited_cuda_visible_devices():
+    settings = ServerSettings(pmemd_cuda_path="mock_pmemd_cuda")
+    with patch("shutil.which",
+               side_effect={"mock_pmemd_cuda": "/usr/bin/mock_pmemd_cuda"}.get), \
+         patch.dict(os.environ, {"CUDA_VISIBLE_DEVICES": "2,3"}), \
+         patch("src.server._detect_gpus") as mock_detect:
+        server = AmberServer(settings)
+
+    # Runs are pinned to the GPUs the server was given, not every GPU on the host
+    assert server._gpu_devices == ["2", "3"]
+    mock_detect.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_minimizations_use_separate_gpus(tmp_path):
+    settings = ServerSettings(
+        pmemd_cuda_path="mock_pmemd_cuda", cuda_visible_devices="0,1"
+    )
+    with patch(
+        "shutil.which",
+        side_effect=lambda name: (
+            "/usr/bin/mock_pmemd_cuda" if name == "mock_pmemd_cuda" else None
+        ),
+    ):
+        server = AmberServer(settings)
+    assert server._gpu_devices == ["0", "1"]
+
+    running = []
+    devices = []
+
+    async def mock_run_tool(cmd, tmpdir, name, env=None):
+        devices.append(env["CUDA_VISIBLE_DEVICES"])
+        running.append(env["CUDA_VISIBLE_DEVICES"])
+        assert len(set(running)) == len(running)  # no GPU is shared
+        await asyncio.sleep(0.01)
+        running.remove(env["CUDA_VISIBLE_DEVICES"])
+        return 0
+
+    workdirs = []
+    for i in range(4):
+        workdir = tmp_path / str(i)
+        workdir.mkdir()
+        (workdir / "pmemd.stdout").write_text("")
+        workdirs.append(workdir)
+
+    with patch.object(server, "_run_tool", side_effect=mock_run_tool), \
+         patch.object(server, "_convert_to_pdb"):
+        results = await asyncio.gather(
+            *(server._run_minimization(w, 100, False) for w in workdirs)
+        )
+
+    assert all(result["success"] for result in results)
+    assert sorted(devices) == ["0", "0", "1", "1"]
+
+
+def test_select_pmemd_precision_build():
+    settings = ServerSettings(pmemd_cuda_path="pmemd.cuda", precision="DPFP")
+    with patch("shutil.which", side_effect=lambda name: f"/opt/amber/bin/{name}"), \
+         patch("src.server._detect_gpus", return_value=[]):
+        server = AmberServer(settings)
+    assert server._pmemd == "/opt/amber/bin/pmemd.cuda_DPFP"
+    assert server._pmemd_is_cuda is True
+
+
+@pytest.mark.asyncio
+async def test_run_minimization_cuda_flags(tmp_path):
+    with patch("shutil.which", side_effect={"pmemd.cuda": "/usr/bin/pmemd.cuda"}.get), \
+         patch("src.server._detect_gpus", return_value=[]):
+        server = AmberServer(ServerSettings())
+    (tmp_path / "pmemd.stdout").write_text("")
+
+    with patch.object(server, "_run_tool", return_value=0) as mock_tool, \
+         patch.object(server, "_convert_to_pdb"):
+        result = await server._run_minimization(tmp_path, 100, False)
+
+    assert result["success"] is True
+    cmd = mock_tool.call_args[0][0]
+    assert cmd[0] == "/usr/bin/pmemd.cuda"
+    assert "-AllowSmallBox" in cmd
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+from src.tleap_pool import TleapPool, TleapWorkerError
+
+FAKE_TLEAP = """import sys
+import time
+print("-I: Adding /fake/dat/leap to search path.", flush=True)
+for line in sys.stdin:
+    line = line.strip()
+    if line == "quit":
+        break
+    if line.startswith("source "):
+        path = line[len("source "):].strip('"')
+        print(f"----- Source: {path}", flush=True)
+        if "hang" in path:
+            continue
+        if "slow" in path:
+            time.sleep(0.5)
+            print("Error! slow script failed", flush=True)
+        print(f"----- Source of {path} done", flush=True)
+"""
+
+
+@pytest.fixture
+def fake_tleap(tmp_path):
+    script = tmp_path / "fake_tleap.py"
+    script.write_text(FAKE_TLEAP)
+    tleap = tmp_path / "tleap"
+    tleap.write_text(f"#!/bin/sh\nexec {sys.executable} {script}\n")
+    tleap.chmod(0o755)
+    return str(tleap)
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_worker(fake_tleap, tmp_path):
+    pool = TleapPool(fake_tleap, size=1, timeout=10)
+    script = tmp_path / "prep.leap"
+    script.write_text("mol = loadpdb test.pdb\n")
+
+    try:
+        first = await pool.source(script, "ff19SB", "tip3p")
+        second = await pool.source(script, "ff19SB", "tip3p")
+        assert f"Source of {script} done" in first
+        assert f"Source of {script} done" in second
+        assert len(pool._workers) == 1
+
+        # A different force field gets its own worker
+        await pool.source(script, "ff14SB", "tip3p")
+        assert len(pool._workers) == 2
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_replaces_hung_worker(fake_tleap, tmp_path):
+    pool = TleapPool(fake_tleap, size=1, timeout=1)
+    hang = tmp_path / "hang.leap"
+    hang.write_text("")
+    script = tmp_path / "prep.leap"
+    script.write_text("")
+
+    try:
+        with pytest.raises(TleapWorkerError):
+            await pool.source(hang, "ff19SB", "tip3p")
+        assert pool._workers == []
+
+        log = await pool.source(script, "ff19SB", "tip3p")
+        assert f"Source of {script} done" in log
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_replaces_cancelled_worker(fake_tleap, tmp_path):
+    pool = TleapPool(fake_tleap, size=1, timeout=10)
+    slow = tmp_path / "slow.leap"
+    slow.write_text("")
+    script = tmp_path / "prep.leap"
+    script.write_text("")
+
+    try:
+        task = asyncio.create_task(pool.source(slow, "ff19SB", "tip3p"))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert pool._workers == []
+
+        # The next request must not see the rest of the cancelled script's output
+        log = await pool.source(script, "ff19SB", "tip3p")
+        assert f"Source of {script} done" in log
+        assert "slow" not in log
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_spawn_options(fake_tleap, tmp_path):
+    pool = TleapPool(
+        fake_tleap, size=1, timeout=10, spawn_options={"start_new_session": True}
+    )
+    script = tmp_path / "prep.leap"
+    script.write_text("")
+
+    try:
+        await pool.source(script, "ff19SB", "tip3p")
+        pid = pool._workers[0]._process.pid
+        assert os.getsid(pid) == pid
+    finally:
+        await pool.close()